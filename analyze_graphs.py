@@ -1,42 +1,27 @@
 #!/usr/bin/env python3
 
 import argparse
-from collections import defaultdict, deque
+from collections import defaultdict
 import graphviz
+import json
 from pathlib import Path
 import pickle
-import sys
-from typing import Any, Dict, List, Optional, Set
+import random
+from typing import Any, Dict, List, Optional, Tuple
 
 from graph import Graph
-from graph_utils import dfs, bfs, get_sccs
+from graph_utils import bfs, dominators, get_sccs, min_feedback_vertex_set, node_name
+from condensation import Condensation, load_condensation, reduce_graph
 
 
 
-def gen_scc_graph(orig_graph:Graph, sccs:List[str]):
-    node_id = 0
-    og_node_to_scc_node = dict()
-    for scc in sccs:
-        num_nodes = 0
-        scc_size = len(scc)
-        for n in scc:
-            og_node_to_scc_node[n] = 'scc%i_%i'%(node_id, scc_size)
-            num_nodes += 1
-        node_id += 1
+def gen_scc_graph(cond:Condensation)->Graph:
+    scc_names = ['scc%i_%i'%(i, size) for i, size in enumerate(cond.sizes)]
+    scc_graph = Graph(scc_names)
 
-    scc_graph = Graph(list(og_node_to_scc_node.values()))
-
-    for src, sinks in orig_graph.edges.items():
-        scc_src = og_node_to_scc_node[src]
-        for sink in sinks:
-            scc_sink = og_node_to_scc_node[sink]
-            if scc_src == scc_sink:
-                # don't add self edges -- that's assumed
-                continue
-            if scc_sink in scc_graph.edges[scc_src]:
-                # also don't add multiple edges
-                continue
-            scc_graph.addEdge(scc_src, scc_sink)
+    for i, sinks in enumerate(cond.dag_edges):
+        for j in sinks:
+            scc_graph.addEdge(scc_names[i], scc_names[j])
 
     return scc_graph
 
@@ -47,6 +32,103 @@ def gen_dot(g:Graph, node_mapping:Dict[int, Any]=dict())->graphviz.Digraph:
             dot.edge(str(node), str(d))
     return dot
 
+def scc_groups(cond:Condensation)->Dict[str, str]:
+    # same node names as gen_scc_graph
+    return {n:'scc%i_%i'%(cond.membership[n], cond.sizes[cond.membership[n]]) for n in cond.membership}
+
+def bfs_groups(g:Graph, safety:str)->Dict[str, str]:
+    labeled_nodes = bfs(g, safety)
+    layer_sizes = defaultdict(int)
+    for dist in labeled_nodes.values():
+        layer_sizes[dist] += 1
+    groups = dict()
+    for n, dist in labeled_nodes.items():
+        if dist is None:
+            groups[n] = 'unreachable_%i'%layer_sizes[None]
+        else:
+            groups[n] = 'layer%i_%i'%(dist, layer_sizes[dist])
+    return groups
+
+def collapse_graph(g:Graph, node2group:Dict[str, str])->Tuple[Graph, Dict[Tuple[str, str], int]]:
+    '''
+    Merges the nodes of each group into a single summary node, dropping edges within a group.
+    Returns the summary graph and the number of original edges between each pair of summary nodes.
+    '''
+    edge_counts = defaultdict(int)
+    for src, sinks in g.edges.items():
+        for sink in sinks:
+            if node2group[src] != node2group[sink]:
+                edge_counts[(node2group[src], node2group[sink])] += 1
+    summary = Graph(list(set(node2group.values())))
+    for src, sink in edge_counts:
+        summary.addEdge(src, sink)
+    return summary, edge_counts
+
+def sample_graph(g:Graph, max_nodes:int, keep:List[str]=[], seed:int=0)->Graph:
+    '''
+    Returns the subgraph induced by (at most) max_nodes randomly chosen nodes, always including keep
+    '''
+    if len(g.nodes) <= max_nodes:
+        return g
+    keep = [n for n in keep if n in g.nodes]
+    rest = [n for n in g.nodes if n not in keep]
+    nodes = set(keep + random.Random(seed).sample(rest, max(0, max_nodes - len(keep))))
+    sampled = Graph(list(nodes))
+    for src, sinks in g.edges.items():
+        if src in nodes:
+            for sink in sinks:
+                if sink in nodes:
+                    sampled.addEdge(src, sink)
+    return sampled
+
+def dominator_subtrees(idom:Dict[str, Optional[str]])->Tuple[Dict[str, int], Dict[str, int]]:
+    '''
+    Returns the depth of each node in the dominator tree and the number of nodes it dominates
+    (excluding itself)
+    '''
+    children = defaultdict(list)
+    for n, parent in idom.items():
+        if parent is not None:
+            children[parent].append(n)
+    root = next(n for n, parent in idom.items() if parent is None)
+    depth = {root: 0}
+    order = [root]
+    for n in order:
+        for c in children[n]:
+            depth[c] = depth[n] + 1
+            order.append(c)
+    counts = dict((n, 0) for n in idom)
+    # children come after their parent in order
+    for n in reversed(order):
+        if idom[n] is not None:
+            counts[idom[n]] += counts[n] + 1
+    return depth, counts
+
+def write_dot(g:Graph, path:Path, edge_counts:Dict[Tuple[str, str], int]=dict())->None:
+    '''
+    Streams the graph to a DOT file without building it in memory or laying it out
+    '''
+    with path.open('w') as f:
+        f.write('digraph {\n')
+        for n in g.nodes:
+            f.write('  "{}"\n'.format(n))
+        for src, sinks in g.edges.items():
+            for sink in sinks:
+                count = edge_counts.get((src, sink), 1)
+                attrs = ' [label={}]'.format(count) if count > 1 else ''
+                f.write('  "{}" -> "{}"{}\n'.format(src, sink, attrs))
+        f.write('}\n')
+
+def write_json(g:Graph, path:Path, edge_counts:Dict[Tuple[str, str], int]=dict())->None:
+    '''
+    Writes the graph as {"nodes": [...], "links": [...]}, the format of d3-force based viewers
+    '''
+    nodes = [{'id': n} for n in g.nodes]
+    links = [{'source': src, 'target': sink, 'count': edge_counts.get((src, sink), 1)}
+             for src, sinks in g.edges.items() for sink in sinks]
+    with path.open('w') as f:
+        json.dump({'nodes': nodes, 'links': links}, f)
+
 
 # Simple Test
 # if __name__ == "__main__":
@@ -61,15 +143,30 @@ def gen_dot(g:Graph, node_mapping:Dict[int, Any]=dict())->graphviz.Digraph:
 #     print(sccs)
 
 if __name__ == "__main__":
-    proc_options = ['list', 'num', 'hist', 'bfs', 'dot', 'scc-dot', 'max-out-degree']
+    proc_options = ['list', 'num', 'hist', 'bfs', 'dot', 'scc-dot', 'scc-depth', 'max-out-degree',
+                    'stream-dot', 'json', 'reduce', 'dominators', 'fvs']
     parser = argparse.ArgumentParser(description="Find Strongly Connected Components")
     parser.add_argument('input_file', help='Pickled list of edges (.pkl), or string of hyperedges that can be evaluated (.out)')
     parser.add_argument('--proc', metavar="<PROC_TYPE>", choices=proc_options, default='num',
                         help='The type of processing to do: <{}>'.format('|'.join(proc_options)))
     parser.add_argument('--remove', metavar="<NODES_TO_REMOVE>", help='A semicolon delimited list of node names to remove', default='')
     parser.add_argument('--safety', metavar="<SAFETY PROPERTY>", help="Name of safety property node", default='Prop')
+    parser.add_argument('--backend', choices=['python', 'sparse'], default='python',
+                        help='Implementation of the graph algorithms, sparse requires scipy')
+    parser.add_argument('--collapse', choices=['none', 'scc', 'bfs'], default='none',
+                        help='For stream-dot and json: merge each SCC or BFS layer into a summary node')
+    parser.add_argument('--max-nodes', dest='max_nodes', type=int, default=None,
+                        help='For stream-dot and json: randomly sample at most this many nodes')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for --max-nodes')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='For fvs: seconds to search for a minimum feedback vertex set before reporting bounds')
+    parser.add_argument('--no-cache', dest='no_cache', action='store_true',
+                        help='Recompute the SCC condensation instead of using the cached one')
     args = parser.parse_args()
 
+    if args.backend == 'sparse':
+        from graph_utils_sparse import bfs, get_sccs
+
     proc = args.proc
     remove = args.remove
     input_file = Path(args.input_file)
@@ -82,10 +179,9 @@ if __name__ == "__main__":
     # Note: this won't happen with the pickled edge files because there would be no edges listed
     nodes = set()
     if input_file.suffix == '.pkl':
-        edges = pickle.load(input_file.open('rb'))
+        labeled_edges = pickle.load(input_file.open('rb'))
+        edges = [(node_name(n1), node_name(n2)) for n1, n2 in labeled_edges]
         for n1, n2 in edges:
-            n1 = str(n1)
-            n2 = str(n2)
             nodes.add(n1)
             nodes.add(n2)
     elif input_file.suffix == '.out':
@@ -116,8 +212,13 @@ if __name__ == "__main__":
     for n1, n2 in edges:
         g.addEdge(n1, n2)
 
+    def condensation()->Condensation:
+        if args.no_cache:
+            return Condensation(g, get_sccs(g))
+        return load_condensation(g, input_file, tuple(sorted(remove)), get_sccs)
+
     if proc == "list":
-        sccs = get_sccs(g)
+        sccs = condensation().sccs
         print ("Following are strongly connected components " +
                "in given graph")
         for scc in sccs:
@@ -125,19 +226,15 @@ if __name__ == "__main__":
                 print(n, end=' ')
             print()
     elif proc == "num":
-        sccs = get_sccs(g)
-        print('Found {} SCCs of the following lengths:'.format(len(sccs)))
-        hist = defaultdict(int)
-        for scc in sccs:
-            hist[len(scc)] += 1
+        cond = condensation()
+        print('Found {} SCCs of the following lengths:'.format(len(cond.sccs)))
+        hist = defaultdict(int, cond.size_hist())
         print(hist)
     elif proc == "hist":
-        sccs = get_sccs(g)
+        cond = condensation()
         from matplotlib import pyplot as plt
 
-        hist = defaultdict(int)
-        for scc in sccs:
-            hist[len(scc)] += 1
+        hist = cond.size_hist()
 
         length, freq = zip(*sorted(hist.items()))
         length = list(map(int, length))
@@ -182,9 +279,65 @@ if __name__ == "__main__":
                                "already exists, aborting dot file rendering.".format(dotfilepath))
         print('Writing SCC graphviz file to {}'.format(dotfilepath))
 
-        scc_graph = gen_scc_graph(g, get_sccs(g))
+        scc_graph = gen_scc_graph(condensation())
         dot = gen_dot(scc_graph)
         dot.render(str(dotfilepath))
+    elif proc in ['stream-dot', 'json']:
+        suffix = '.dot' if proc == 'stream-dot' else '.json'
+        outpath = Path("./") / (input_file.stem + ('' if args.collapse == 'none' else '-' + args.collapse) + suffix)
+        if outpath.is_file():
+            raise RuntimeError("It looks like a file named {} "
+                               "already exists, aborting.".format(outpath))
+
+        keep = [args.safety]
+        edge_counts = dict()
+        if args.collapse == 'scc':
+            node2group = scc_groups(condensation())
+        elif args.collapse == 'bfs':
+            node2group = bfs_groups(g, args.safety)
+        if args.collapse != 'none':
+            keep = [node2group[args.safety]] if args.safety in node2group else []
+            g, edge_counts = collapse_graph(g, node2group)
+        if args.max_nodes is not None:
+            g = sample_graph(g, args.max_nodes, keep, args.seed)
+
+        print('Writing {} nodes to {}'.format(len(g.nodes), outpath))
+        if proc == 'stream-dot':
+            write_dot(g, outpath, edge_counts)
+        else:
+            write_json(g, outpath, edge_counts)
+    elif proc == 'scc-depth':
+        cond = condensation()
+        print('longest path in SCC graph:', cond.max_depth)
+    elif proc == 'reduce':
+        outpath = Path("./") / (input_file.stem + '-reduced.pkl')
+        if outpath.is_file():
+            raise RuntimeError("It looks like a file named {} "
+                               "already exists, aborting.".format(outpath))
+        reduced = reduce_graph(g, condensation())
+        reduced_edges = [(src, sink) for src in reduced.nodes for sink in reduced.edges[src]]
+        if input_file.suffix == '.pkl':
+            # in the order and with the labels of the input, like gen_graph.py --reduce
+            kept = set(reduced_edges)
+            reduced_edges = [(n1, n2) for n1, n2 in labeled_edges if (node_name(n1), node_name(n2)) in kept]
+        print('Kept {}/{} edges, writing them to {}'.format(len(reduced_edges), len(edges), outpath))
+        with outpath.open('wb') as f:
+            pickle.dump(reduced_edges, f)
+    elif proc == 'dominators':
+        idom = dominators(g, args.safety)
+        depth, counts = dominator_subtrees(idom)
+        print('dominator tree of {} nodes reachable from {}, depth {}'.format(len(idom), args.safety,
+                                                                              max(depth.values())))
+        print('nodes dominating the most others:')
+        for n in sorted((n for n in counts if n != args.safety), key=lambda n: -counts[n])[:10]:
+            print('  {}: {} (immediate dominator {})'.format(n, counts[n], idom[n]))
+    elif proc == 'fvs':
+        fvs, lower = min_feedback_vertex_set(g, args.timeout)
+        if lower == len(fvs):
+            print('minimum feedback vertex set: {}'.format(len(fvs)))
+        else:
+            print('minimum feedback vertex set in [{}, {}] (timed out)'.format(lower, len(fvs)))
+        print(' '.join(sorted(fvs)))
     elif proc == 'max-out-degree':
         max_out_degree=max([0] + [len(sinks) for sinks in g.edges.values()])
         print(f'max out degree: {max_out_degree:05}')
@@ -0,0 +1,15 @@
+#!/bin/bash
+# Compares the number of solver calls of the gen_graph.py --order strategies
+# usage: ./bench-orders.sh <dumped filename>... (as dumped by IC3Ref, see README.md)
+
+STORE=order-bench.npz
+ORDERS="index length overlap distance frequency"
+
+for dump in "$@"; do
+    for order in $ORDERS; do
+        echo "Running $order order on $dump"
+        ./gen_graph.py -t ${dump}-trans.cnf -i ${dump}-inv.cnf -ip ${dump}-inv-primed.cnf \
+                       -o "$(basename -- $dump)-$order" --order $order --stats $STORE $BENCH_FLAGS > /dev/null
+    done
+done
+python3 corpus_stats.py --store $STORE show --columns num_nodes,num_edges,solver_calls,runtime
@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 import argparse
-from z3 import Solver, Not, And, Or, sat, unsat, Implies, Bool, substitute, ExprRef
+import multiprocessing
+import sys
+from z3 import Solver, Not, And, sat, unsat, Implies, substitute, ExprRef
 
-from cnf_utils import read_cnf, get_lit
+from cnf_utils import read_int_cnf, iter_int_cnf, iter_cnf_lines, add_shared_cnf, int_clause_to_z3, \
+    get_lit, check_inductiveness_chunked, read_concurrently, read_dump_archive, Clause, SharedCNF
 
-from typing import Set
+from typing import Dict, Iterable, List, Sequence, Set, Tuple, Union
 
 def get_free_vars(e: ExprRef) -> Set[ExprRef]:
     free_vars = set()
@@ -25,27 +28,164 @@ def get_free_vars(e: ExprRef) -> Set[ExprRef]:
 
     return free_vars
 
+def read_int_prime_mapping(filename:str) -> Dict[int, int]:
+    prime_mapping = dict()
+    for line in iter_cnf_lines(filename):
+        if line.strip():
+            k, v = line.split()
+            prime_mapping[int(k)] = int(v)
+    return prime_mapping
+
+def prime_int_clause(clause:Sequence[int], prime_mapping:Dict[int, int]) -> List[int]:
+    # variables without a mapping are left as is, like substitute does
+    return [prime_mapping.get(l, l) if l > 0 else -prime_mapping.get(-l, -l) for l in clause]
+
+def failing_clauses(solver:Solver, clauses:Sequence[List[int]], idxs:Sequence[int]) -> List[int]:
+    '''
+    Returns the indices of the clauses that are not implied by the solver's assertions.
+    Uses the negated literals of each clause as assumptions, so no push/pop is needed.
+    '''
+    failed = []
+    for i in idxs:
+        if solver.check([Not(get_lit(str(l))) for l in clauses[i]]) == sat:
+            failed.append(i)
+    return failed
+
+# per-process state for the fast consecution check
+consecution_solver = None
+primed_inv = None
+
+def init_consecution(trans:Union[Iterable[List[int]], Tuple[str, int]], invl:List[List[int]],
+                     prime_mapping:Dict[int, int]):
+    '''
+    trans is either the integer clauses or the handle of a SharedCNF set up by the parent process
+    '''
+    global consecution_solver, primed_inv
+    primed_inv = [prime_int_clause(c, prime_mapping) for c in invl]
+
+    consecution_solver = Solver()
+    # IMPORTANT invariant of IC3ref, see below
+    consecution_solver.add(get_lit('-1'))
+    if isinstance(trans, tuple):
+        add_shared_cnf(consecution_solver, trans)
+    else:
+        for c in trans:
+            consecution_solver.add(int_clause_to_z3(c))
+    for c in invl:
+        consecution_solver.add(int_clause_to_z3(c))
+
+def check_consecution_chunk(idxs:Sequence[int]) -> List[int]:
+    return failing_clauses(consecution_solver, primed_inv, idxs)
+
+def chunked_check(trans:Iterable[List[int]], invl:List[List[int]], prime_mapping:Dict[int, int],
+                  num_chunks:int, jobs:int) -> bool:
+    '''
+    Checks consecution as one query per chunk of the primed invariant, in parallel,
+    stopping at the first chunk that fails.
+    '''
+    primed_inv = [prime_int_clause(c, prime_mapping) for c in invl]
+    # IMPORTANT invariant of IC3ref, see below
+    base = [[-1]] + list(trans) + invl
+
+    print('inv /\\ T |= inv ({} chunks)...'.format(num_chunks), end='', flush=True)
+    failed = check_inductiveness_chunked(base, primed_inv, num_chunks, jobs)
+    print('OK' if failed is None else 'FAIL in chunk with clauses {}'.format(failed))
+    return failed is None
+
+def fast_check(init:Iterable[List[int]], trans:Iterable[List[int]], invl:List[List[int]],
+               prime_mapping:Dict[int, int], jobs:int=1) -> bool:
+    '''
+    Checks the invariant clause by clause on incremental solvers, mapping primes
+    on the integer literals. Prints the clauses that fail and returns True if all checks pass.
+    '''
+    assert invl
+
+    print("init -> inv...", end='', flush=True)
+    s = Solver()
+    s.add(get_lit('-1'))
+    for c in init:
+        s.add(int_clause_to_z3(c))
+    # add property to initial states
+    s.add(int_clause_to_z3(invl[0]))
+    failed_init = failing_clauses(s, invl, range(len(invl)))
+    print('OK' if not failed_init else 'FAIL {}'.format(failed_init))
+
+    print('inv /\\ T |= inv...', end='', flush=True)
+    if jobs > 1:
+        chunks = [list(range(len(invl)))[i::jobs] for i in range(jobs)]
+        # parse trans once and share it with the workers
+        shared_trans = SharedCNF.from_clauses(trans)
+        try:
+            with multiprocessing.Pool(jobs, initializer=init_consecution,
+                                      initargs=(shared_trans.handle(), invl, prime_mapping)) as pool:
+                failed_cons = sorted(i for res in pool.map(check_consecution_chunk, chunks) for i in res)
+        finally:
+            # also unlinks the shared memory, even if a worker failed
+            shared_trans.close()
+    else:
+        init_consecution(trans, invl, prime_mapping)
+        failed_cons = check_consecution_chunk(range(len(invl)))
+    print('OK' if not failed_cons else 'FAIL {}'.format(failed_cons))
+
+    # prop is the first clause of the invariant, so inv -> prop holds trivially
+    print('inv -> prop...OK')
+
+    inv_vars = set(abs(l) for c in invl for l in c)
+    assert all(v in prime_mapping for v in inv_vars), "expecting all current state variables"
+    return not failed_init and not failed_cons
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Check invariant on a transition system")
     parser.add_argument("--init", type=str, help='Path to CNF file for initial states')
     parser.add_argument("--trans", type=str, help='Path to CNF file for transition relation')
     parser.add_argument("--inv", type=str, help='Path to CNF file for invariant')
     parser.add_argument("--primes", type=str, help='Path to space delimited mapping file')
+    parser.add_argument("--archive", type=str, default=None,
+                        help='A tar archive (or - for stdin) with the dumped files, read as it is written, '
+                        'instead of --init, --trans, --inv and --primes')
+    parser.add_argument("--fast", action='store_true',
+                        help='Check clause by clause and report the failing clauses')
+    parser.add_argument("-j", dest='jobs', type=int, default=None,
+                        help='Number of processes to split the clauses of --fast (default 1) '
+                        'or --chunks (default all cores) between')
+    parser.add_argument("--chunks", type=int, default=0,
+                        help='Only check consecution, as one query per chunk of the invariant in parallel')
 
     args = parser.parse_args()
-    file_prime = args.primes
 
-    init  = And([c._expr for c in read_cnf(args.init)])
-    trans = And([c._expr for c in read_cnf(args.trans)])
-    invl  = read_cnf(args.inv)
+    # read once, named pipes and stdin ('-') are parsed while they are written
+    if args.archive is not None:
+        dump = read_dump_archive(args.archive)
+        init_ints, trans_ints, inv_ints = dump['init'], dump['trans'], dump['inv']
+        int_prime_mapping = dict(dump['mapping'])
+    else:
+        parsers = [(iter_int_cnf, args.trans), (read_int_cnf, args.inv), (read_int_prime_mapping, args.primes)]
+        # --chunks only checks consecution
+        if args.chunks == 0:
+            parsers.append((read_int_cnf, args.init))
+        inputs = read_concurrently(parsers)
+        trans_ints, inv_ints, int_prime_mapping = inputs[:3]
+        init_ints = inputs[3] if args.chunks == 0 else None
+
+    if args.chunks > 0:
+        ok = chunked_check(trans_ints, inv_ints, int_prime_mapping, args.chunks,
+                           args.jobs or multiprocessing.cpu_count())
+        sys.exit(0 if ok else 1)
+
+    if args.fast:
+        ok = fast_check(init_ints, trans_ints, inv_ints, int_prime_mapping, args.jobs or 1)
+        sys.exit(0 if ok else 1)
+
+    init  = And([int_clause_to_z3(c) for c in init_ints])
+    trans = And([int_clause_to_z3(c) for c in trans_ints])
+    invl  = [Clause(int_clause_to_z3(c)) for c in inv_ints]
     assert invl
     prop  = invl[0]._expr
     inv   = And([c._expr for c in invl])
 
     prime_mapping = []
-    for line in open(file_prime, "r").read().splitlines():
-        k, v = line.split()
-        prime_mapping.append((get_lit(k), get_lit(v)))
+    for k, v in int_prime_mapping.items():
+        prime_mapping.append((get_lit(str(k)), get_lit(str(v))))
 
 
     s = Solver()
@@ -1,4 +1,14 @@
-from typing import Dict, List, Sequence
+from array import array
+import gzip
+import mmap
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import stat
+import sys
+import tarfile
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
 from z3 import And, Bool, BoolRef, ExprRef, Not, Or, Solver, unsat, sat
 
@@ -60,9 +70,8 @@ def get_lit(litstr:str) -> BoolRef:
 
 def read_cnf(filename:str) -> List[Clause]:
     clauses = []
-    f = open(filename, 'r')
-    for line in f.read().split('\n'):
-        line = line.strip()
+    for line in iter_cnf_lines(filename):
+        line = line.decode().strip()
         # ignore the zero termination
         if line[-2:] == " 0":
             line = line[:-2]
@@ -71,10 +80,206 @@ def read_cnf(filename:str) -> List[Clause]:
         if line[0] == 'p' or line[0] == 'c':
             continue
         clauses.append(Clause(Or(list(map(get_lit, line.split())))))
-    f.close()
     return clauses
 
 
+def is_stream(filename:str) -> bool:
+    '''
+    True for stdin ('-') and anything that isn't a regular file, e.g. a named pipe
+    '''
+    return filename == '-' or not stat.S_ISREG(os.stat(filename).st_mode)
+
+
+def iter_cnf_lines(filename:str) -> Iterator[bytes]:
+    '''
+    Yields the lines of a CNF file without reading the whole file into memory:
+    gzip compressed files (.gz) are decompressed while streaming, others are memory mapped.
+    Streams (stdin as '-' or named pipes) are read line by line as they are written.
+    '''
+    if filename == '-':
+        yield from sys.stdin.buffer
+        return
+    if filename.endswith('.gz'):
+        with gzip.open(filename, 'rb') as f:
+            yield from f
+        return
+    if is_stream(filename):
+        with open(filename, 'rb') as f:
+            yield from f
+        return
+    with open(filename, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # can't map an empty file
+            return
+        with mm:
+            line = mm.readline()
+            while line:
+                yield line
+                line = mm.readline()
+
+
+def iter_int_cnf(filename:str) -> Iterator[List[int]]:
+    '''
+    Yields the clauses of a CNF file as lists of integer literals, without building z3 terms
+    '''
+    return parse_int_cnf_lines(iter_cnf_lines(filename))
+
+
+def parse_int_cnf_lines(lines:Iterable[bytes]) -> Iterator[List[int]]:
+    for line in lines:
+        line = line.strip()
+        if not line or line[:1] == b'p' or line[:1] == b'c':
+            continue
+        lits = [int(l) for l in line.split()]
+        # ignore the zero termination
+        if lits[-1] == 0:
+            lits = lits[:-1]
+        if lits:
+            yield lits
+
+
+def read_int_cnf(filename:str) -> List[List[int]]:
+    return list(iter_int_cnf(filename))
+
+
+def read_concurrently(parsers:Sequence[Tuple[Callable[[str], Any], str]]) -> List[Any]:
+    '''
+    Returns the result of each (parser, filename). Streams are parsed concurrently in threads,
+    so the order a writer (e.g. IC3Ref dumping into named pipes) fills them in doesn't matter and
+    parsing overlaps with writing. Regular files are parsed as usual, lazily if the parser is.
+    '''
+    results = [None]*len(parsers)
+    errors = []
+    def parse(i:int, parser:Callable[[str], Any], filename:str)->None:
+        try:
+            res = parser(filename)
+            results[i] = list(res) if isinstance(res, Iterator) else res
+        except Exception as e:
+            errors.append(e)
+
+    threads = []
+    for i, (parser, filename) in enumerate(parsers):
+        if is_stream(filename):
+            threads.append(threading.Thread(target=parse, args=(i, parser, filename)))
+            threads[-1].start()
+        else:
+            results[i] = parser(filename)
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+# file name endings of the files dumped by IC3Ref, the longest first so inv-primed isn't taken for inv
+DUMP_FILES = [('inv-primed', 'inv-primed.cnf'), ('mapping', 'mapping.txt'), ('trans', 'trans.cnf'),
+              ('init', 'init.cnf'), ('inv', 'inv.cnf')]
+
+
+def read_dump_archive(filename:str) -> Dict[str, List[List[int]]]:
+    '''
+    Reads the files of an IC3Ref dump from a (possibly compressed) tar archive, '-' for stdin.
+    The archive is read as a stream, one member at a time as they are written. Returns the
+    integer clauses keyed on 'trans', 'inv', 'inv-primed' and 'init', and the variable
+    mapping as [current, next] pairs keyed on 'mapping'.
+    '''
+    if filename == '-':
+        tar = tarfile.open(fileobj=sys.stdin.buffer, mode='r|*')
+    else:
+        tar = tarfile.open(filename, mode='r|*')
+    dump = dict()
+    with tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            for role, ending in DUMP_FILES:
+                if member.name.endswith(ending):
+                    dump[role] = list(parse_int_cnf_lines(tar.extractfile(member)))
+                    break
+    return dump
+
+
+def add_cnf(slv:Solver, filename:str) -> int:
+    '''
+    Adds the clauses of a CNF file to the solver one at a time, returns the number of clauses
+    '''
+    num_clauses = 0
+    for c in iter_int_cnf(filename):
+        slv.add(int_clause_to_z3(c))
+        num_clauses += 1
+    return num_clauses
+
+
+class SharedCNF:
+    '''
+    A CNF in shared memory, as clause offsets followed by a flat array of int32 literals.
+    The parent process parses it once with from_clauses and passes handle() to workers,
+    which attach to it without copying or re-parsing.
+    '''
+    def __init__(self, shm:shared_memory.SharedMemory, num_clauses:int, owner:bool)->None:
+        self.shm = shm
+        self.num_clauses = num_clauses
+        self.owner = owner
+        self.ints = shm.buf.cast('i')
+        self.offsets = self.ints[:num_clauses + 1]
+        self.lits = self.ints[num_clauses + 1:]
+
+    @staticmethod
+    def from_clauses(clauses:Iterable[Sequence[int]])->'SharedCNF':
+        offsets = array('i', [0])
+        lits = array('i')
+        for c in clauses:
+            lits.extend(c)
+            offsets.append(len(lits))
+        num_clauses = len(offsets) - 1
+        shm = shared_memory.SharedMemory(create=True, size=max(1, (len(offsets) + len(lits))*offsets.itemsize))
+        ints = shm.buf.cast('i')
+        ints[:len(offsets)] = offsets
+        ints[len(offsets):len(offsets) + len(lits)] = lits
+        ints.release()
+        return SharedCNF(shm, num_clauses, owner=True)
+
+    def handle(self)->Tuple[str, int]:
+        return (self.shm.name, self.num_clauses)
+
+    @staticmethod
+    def attach(handle:Tuple[str, int])->'SharedCNF':
+        name, num_clauses = handle
+        # workers share the resource tracker of the parent, which unlinks the memory
+        shm = shared_memory.SharedMemory(name=name)
+        return SharedCNF(shm, num_clauses, owner=False)
+
+    def clauses(self)->Iterator[Sequence[int]]:
+        for i in range(self.num_clauses):
+            yield self.lits[self.offsets[i]:self.offsets[i+1]].tolist()
+
+    def close(self)->None:
+        self.offsets.release()
+        self.lits.release()
+        self.ints.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def add_shared_cnf(slv:Solver, handle:Tuple[str, int]) -> int:
+    '''
+    Attaches to a SharedCNF and adds its clauses to the solver, returns the number of clauses
+    '''
+    cnf = SharedCNF.attach(handle)
+    for c in cnf.clauses():
+        slv.add(int_clause_to_z3(c))
+    num_clauses = cnf.num_clauses
+    cnf.close()
+    return num_clauses
+
+
+def int_clause_to_z3(clause:Sequence[int]) -> BoolRef:
+    return Or([get_lit(str(l)) for l in clause])
+
+
 def assert_clauses(slv:Solver, clauses:Sequence[Clause]):
     slv.add(And([c._expr for c in clauses]))
 
@@ -89,6 +294,50 @@ def check_inductiveness(slv:Solver, inv2pinv:Dict[Clause, Clause])->bool:
     slv.pop()
     return res
 
+# per-process solver for check_inductiveness_chunked
+chunk_solver = None
+chunk_pinv = None
+
+def init_chunk_worker(base_handle:Tuple[str, int], pinv:Sequence[List[int]]):
+    global chunk_solver, chunk_pinv
+    chunk_solver = Solver()
+    add_shared_cnf(chunk_solver, base_handle)
+    chunk_pinv = pinv
+
+def check_chunk(chunk:Sequence[int]) -> Optional[Sequence[int]]:
+    '''
+    Returns the chunk if base /\\ ~(chunk') is sat and None otherwise
+    '''
+    chunk_solver.push()
+    chunk_solver.add(Or([Not(int_clause_to_z3(chunk_pinv[i])) for i in chunk]))
+    res = chunk_solver.check()
+    chunk_solver.pop()
+    return chunk if res == sat else None
+
+def check_inductiveness_chunked(base:Sequence[List[int]], pinv:Sequence[List[int]],
+                                num_chunks:int, jobs:int) -> Optional[List[int]]:
+    '''
+    Checks base |= pinv by splitting pinv into num_chunks chunks, each checked with
+    its own solver in one of jobs worker processes. base should contain trans and the
+    (unprimed) invariant. Stops at the first failing chunk and returns the indices of
+    its clauses, or None if every chunk holds.
+    '''
+    chunks = [list(range(len(pinv)))[i::num_chunks] for i in range(num_chunks)]
+    chunks = [c for c in chunks if c]
+    # parsed once, the workers load it from shared memory
+    shared_base = SharedCNF.from_clauses(base)
+    pool = multiprocessing.Pool(jobs, initializer=init_chunk_worker, initargs=(shared_base.handle(), pinv))
+    try:
+        for failed in pool.imap_unordered(check_chunk, chunks):
+            if failed is not None:
+                return failed
+        return None
+    finally:
+        # kills workers still checking other chunks
+        pool.terminate()
+        pool.join()
+        shared_base.close()
+
 def identify_invariants(trans:List[Clause], inv_cand:List[Clause], inv_primed_cand:List[Clause]):
     inv2pinv = dict(zip(inv_cand, inv_primed_cand))
     slv = Solver()
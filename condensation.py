@@ -0,0 +1,155 @@
+from graph import Graph
+from graph_utils import get_sccs
+
+from collections import deque
+from pathlib import Path
+import pickle
+
+from typing import Any, Callable, Dict, List, Set
+
+
+class Condensation:
+    '''
+    The SCC condensation of a graph: the DAG with one node per strongly connected component.
+    SCCs are referred to by their index in sccs, which are sorted by their smallest node so the
+    order doesn't depend on the algorithm (or backend) that found them.
+    '''
+
+    def __init__(self, g:Graph, sccs:List[Set[str]])->None:
+        self.sccs = sorted(sorted(scc) for scc in sccs)
+        self.sizes = [len(scc) for scc in self.sccs]
+
+        # maps each node of the original graph to the index of its SCC
+        self.membership = dict()
+        for i, scc in enumerate(self.sccs):
+            for n in scc:
+                self.membership[n] = i
+
+        # deduplicated edges between SCCs, without self edges
+        dag_edges = [set() for _ in self.sccs]
+        for src, sinks in g.edges.items():
+            scc_src = self.membership[src]
+            for sink in sinks:
+                scc_sink = self.membership[sink]
+                if scc_src != scc_sink:
+                    dag_edges[scc_src].add(scc_sink)
+        self.dag_edges = [sorted(sinks) for sinks in dag_edges]
+
+        self.topo_order = self._topo_order()
+
+        # length of the longest path reaching each SCC from a source SCC
+        self.depth = [0]*len(self.sccs)
+        for i in self.topo_order:
+            for j in self.dag_edges[i]:
+                self.depth[j] = max(self.depth[j], self.depth[i] + 1)
+
+    def _topo_order(self)->List[int]:
+        in_degree = [0]*len(self.sccs)
+        for sinks in self.dag_edges:
+            for j in sinks:
+                in_degree[j] += 1
+        queue = deque(i for i, d in enumerate(in_degree) if d == 0)
+        order = []
+        while queue:
+            i = queue.popleft()
+            order.append(i)
+            for j in self.dag_edges[i]:
+                in_degree[j] -= 1
+                if in_degree[j] == 0:
+                    queue.append(j)
+        assert len(order) == len(self.sccs), "Expecting the condensation to be acyclic"
+        return order
+
+    @property
+    def max_depth(self)->int:
+        return max([0] + self.depth)
+
+    def size_hist(self)->Dict[int, int]:
+        hist = dict()
+        for size in sorted(self.sizes):
+            hist[size] = hist.get(size, 0) + 1
+        return hist
+
+    def transitive_reduction(self)->List[List[int]]:
+        '''
+        Returns the DAG edges that aren't implied by a longer path, using a bitset of the SCCs
+        reachable from each SCC
+        '''
+        position = [0]*len(self.sccs)
+        for k, i in enumerate(self.topo_order):
+            position[i] = k
+        reach = [0]*len(self.sccs)
+        reduced = [[] for _ in self.sccs]
+        for i in reversed(self.topo_order):
+            covered = 0
+            # a sink reachable through another sink comes after it in topological order
+            for j in sorted(self.dag_edges[i], key=lambda j: position[j]):
+                if not (covered >> j) & 1:
+                    reduced[i].append(j)
+                    covered |= reach[j]
+            reach[i] = covered | (1 << i)
+        return [sorted(sinks) for sinks in reduced]
+
+    def scc_subgraph(self, g:Graph, i:int)->Graph:
+        '''
+        Returns the subgraph of g induced by SCC i
+        '''
+        node_set = set(self.sccs[i])
+        sub = Graph(self.sccs[i])
+        for n in self.sccs[i]:
+            for sink in g.edges[n]:
+                if sink in node_set:
+                    sub.addEdge(n, sink)
+        return sub
+
+
+def reduce_graph(g:Graph, cond:Condensation)->Graph:
+    '''
+    Returns g without the edges between SCCs that are implied by a longer path.
+    Edges within an SCC are kept, so the reduced graph has the same SCCs and reachability.
+    '''
+    kept = [set(sinks) for sinks in cond.transitive_reduction()]
+    reduced = Graph(g.nodes)
+    for src in g.nodes:
+        scc_src = cond.membership[src]
+        for sink in g.edges[src]:
+            scc_sink = cond.membership[sink]
+            if scc_src == scc_sink or scc_sink in kept[scc_src]:
+                reduced.addEdge(src, sink)
+    return reduced
+
+
+# bump when the cached condensations change, e.g. the node names of the graphs
+CACHE_VERSION = 3
+
+def cache_path(graph_file:Path)->Path:
+    return graph_file.with_suffix('.cond')
+
+
+def load_condensation(g:Graph, graph_file:Path, key:Any=None,
+                      scc_fun:Callable[[Graph], List[Set[str]]]=get_sccs)->Condensation:
+    '''
+    Returns the condensation of g, read from the cache file next to graph_file if it is
+    still valid and computed (and cached) otherwise.
+    key identifies any preprocessing of the graph (e.g. removed nodes).
+    '''
+    stat = graph_file.stat()
+    cache_key = (CACHE_VERSION, stat.st_size, stat.st_mtime_ns, key)
+    path = cache_path(graph_file)
+    if path.is_file():
+        try:
+            with path.open('rb') as f:
+                cached_key, cond = pickle.load(f)
+            if cached_key == cache_key:
+                return cond
+        except Exception:
+            # unreadable or stale format, just recompute
+            pass
+
+    cond = Condensation(g, scc_fun(g))
+    try:
+        with path.open('wb') as f:
+            pickle.dump((cache_key, cond), f)
+    except OSError:
+        print('Warning: could not write condensation cache to {}'.format(path))
+    return cond
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+'''
+Per-graph metrics for a corpus of induction graphs, stored column-wise in a numpy .npz file.
+Scalar metrics are one array per column. Distributions (e.g. SCC sizes) are stored flattened
+as <column>_values with <column>_offsets delimiting the rows.
+'''
+import argparse
+import os
+from pathlib import Path
+import pickle
+
+import numpy as np
+
+from condensation import Condensation
+from graph import Graph
+from graph_utils import bfs, get_sccs, node_name
+
+from typing import Any, Dict, List, Optional
+
+
+SCALAR_COLUMNS = ['num_nodes', 'num_edges', 'num_sccs', 'max_scc_size', 'bfs_depth',
+                  'cycle_rank_lower', 'cycle_rank_upper', 'runtime', 'solver_calls']
+DIST_COLUMNS = ['scc_sizes', 'bfs_layers', 'out_degree_hist', 'in_degree_hist']
+
+
+def load_graph(input_file:Path)->Graph:
+    '''
+    Reads a pickled list of edges (as written by gen_graph.py --pickle)
+    '''
+    nodes = set()
+    edges = [(node_name(n1), node_name(n2)) for n1, n2 in pickle.load(input_file.open('rb'))]
+    for n1, n2 in edges:
+        nodes.add(n1)
+        nodes.add(n2)
+    g = Graph(list(nodes))
+    for n1, n2 in edges:
+        g.addEdge(n1, n2)
+    return g
+
+
+def degree_hist(degrees:List[int])->List[int]:
+    hist = [0]*(max([0] + degrees) + 1)
+    for d in degrees:
+        hist[d] += 1
+    return hist
+
+
+def graph_metrics(g:Graph, safety:str, runtime:Optional[float]=None,
+                  cond:Optional[Condensation]=None, solver_calls:Optional[int]=None)->Dict[str, Any]:
+    if cond is None:
+        cond = Condensation(g, get_sccs(g))
+
+    bfs_layers = []
+    if safety in g.nodes:
+        labeled_nodes = bfs(g, safety)
+        for dist in labeled_nodes.values():
+            if dist is None:
+                continue
+            while len(bfs_layers) <= dist:
+                bfs_layers.append(0)
+            bfs_layers[dist] += 1
+
+    in_degrees = dict((n, 0) for n in g.nodes)
+    for sinks in g.edges.values():
+        for s in sinks:
+            in_degrees[s] += 1
+
+    # cheap cycle rank bounds (ignoring self loops like cycle_rank.py):
+    # at least 1 with a cycle, at most one less than the size of the largest SCC
+    cyclic_sizes = [size for size in cond.sizes if size > 1]
+    cycle_rank_lower = 1 if cyclic_sizes else 0
+    cycle_rank_upper = max([0] + [size - 1 for size in cyclic_sizes])
+
+    return {
+        'num_nodes': len(g.nodes),
+        'num_edges': sum(len(sinks) for sinks in g.edges.values()),
+        'num_sccs': len(cond.sccs),
+        'max_scc_size': max([0] + cond.sizes),
+        'bfs_depth': len(bfs_layers) - 1,
+        'cycle_rank_lower': cycle_rank_lower,
+        'cycle_rank_upper': cycle_rank_upper,
+        'runtime': np.nan if runtime is None else runtime,
+        'solver_calls': -1 if solver_calls is None else solver_calls,
+        'scc_sizes': sorted(cond.sizes),
+        'bfs_layers': bfs_layers,
+        'out_degree_hist': degree_hist([len(g.edges[n]) for n in g.nodes]),
+        'in_degree_hist': degree_hist(list(in_degrees.values())),
+    }
+
+
+def missing_value(c:str)->Any:
+    return np.nan if c == 'runtime' else -1
+
+
+class StatsStore:
+    '''
+    Rows of metrics, one per graph name, backed by an .npz file
+    '''
+
+    def __init__(self, path:Path)->None:
+        self.path = Path(path)
+        self.rows = dict()
+        if self.path.is_file():
+            with np.load(str(self.path)) as data:
+                names = list(data['name'])
+                for i, name in enumerate(names):
+                    row = dict()
+                    for c in SCALAR_COLUMNS:
+                        # columns added after the store was written are unknown
+                        row[c] = data[c][i].item() if c in data else missing_value(c)
+                    for c in DIST_COLUMNS:
+                        offsets = data[c + '_offsets']
+                        row[c] = data[c + '_values'][offsets[i]:offsets[i+1]].tolist()
+                    self.rows[str(name)] = row
+
+    def add(self, name:str, metrics:Dict[str, Any])->None:
+        # replaces the metrics of a graph that was already analyzed
+        self.rows[name] = metrics
+
+    def column(self, c:str)->np.ndarray:
+        return np.array([self.rows[name][c] for name in self.rows])
+
+    def save(self)->None:
+        names = list(self.rows.keys())
+        arrays = {'name': np.array(names, dtype=str)}
+        for c in SCALAR_COLUMNS:
+            arrays[c] = np.array([self.rows[n][c] for n in names],
+                                 dtype=np.float64 if c == 'runtime' else np.int64)
+        for c in DIST_COLUMNS:
+            lengths = [len(self.rows[n][c]) for n in names]
+            arrays[c + '_offsets'] = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+            arrays[c + '_values'] = np.array([v for n in names for v in self.rows[n][c]], dtype=np.int64)
+        # write to a temporary file first so an interrupted run doesn't lose the store
+        tmp_path = self.path.with_name(self.path.name + '.tmp.npz')
+        np.savez_compressed(str(tmp_path), **arrays)
+        os.replace(str(tmp_path), str(self.path))
+
+
+def append_metrics(store_path:Path, name:str, metrics:Dict[str, Any])->None:
+    store = StatsStore(store_path)
+    store.add(name, metrics)
+    store.save()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect or show induction graph statistics")
+    subparsers = parser.add_subparsers(dest='cmd')
+    add_parser = subparsers.add_parser('add', help='Analyze graphs and add them to the store')
+    add_parser.add_argument('input_files', nargs='+', help='Pickled lists of edges (.pkl)')
+    add_parser.add_argument('--safety', metavar="<SAFETY PROPERTY>", help="Name of safety property node", default='Prop')
+    show_parser = subparsers.add_parser('show', help='Print the scalar metrics in the store')
+    show_parser.add_argument('--columns', default=','.join(SCALAR_COLUMNS),
+                             help='Comma delimited columns to print')
+    parser.add_argument('--store', default='ic3-graph-stats.npz', help='The .npz file with the metrics')
+    args = parser.parse_args()
+
+    store = StatsStore(Path(args.store))
+    if args.cmd == 'add':
+        for f in args.input_files:
+            input_file = Path(f)
+            print('Analyzing', input_file)
+            store.add(input_file.stem, graph_metrics(load_graph(input_file), args.safety))
+            # save after every graph so the store grows incrementally
+            store.save()
+    elif args.cmd == 'show':
+        columns = args.columns.split(',')
+        print('\t'.join(['name'] + columns))
+        for name, row in sorted(store.rows.items()):
+            print('\t'.join([name] + [str(row[c]) for c in columns]))
+    else:
+        parser.print_help()
@@ -1,15 +1,19 @@
 #!/usr/bin/env python3
 import argparse
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from copy import deepcopy
+import hashlib
 from pathlib import Path
 import pickle
+import random
+import signal
+import time
+from condensation import load_condensation
 from graph import Graph
-from graph_utils import is_acyclic, get_scc_graphs, print_graph
+from graph_utils import is_acyclic, get_scc_graphs, print_graph, node_name
 import sys
 
-
-cycle_rank_cache = {}
+from typing import Callable, Dict, FrozenSet, List, Optional, Set, Tuple
 
 
 def graph2id(graph:Graph)->str:
@@ -17,6 +21,116 @@ def graph2id(graph:Graph)->str:
     return "_".join(graph.nodes)
 
 
+# maximum number of leaves of the individualization search in canonical_key
+CANONICAL_MAX_LEAVES = 1000
+
+
+def refine_colors(graph:Graph, preds:Dict[str, List[str]], color:Dict[str, int])->Dict[str, int]:
+    '''
+    (Directed) Weisfeiler-Lehman refinement of a coloring until it's stable.
+    New colors are ranks of the signatures, so they don't depend on the names.
+    '''
+    num_colors = len(set(color.values()))
+    while True:
+        signature = {n:(color[n],
+                        tuple(sorted(color[s] for s in graph.edges[n])),
+                        tuple(sorted(color[p] for p in preds[n]))) for n in graph.nodes}
+        ranks = {sig:i for i, sig in enumerate(sorted(set(signature.values())))}
+        color = {n:ranks[signature[n]] for n in graph.nodes}
+        if len(ranks) == num_colors:
+            return color
+        num_colors = len(ranks)
+
+
+def canonical_edges(graph:Graph, preds:Dict[str, List[str]], color:Dict[str, int],
+                    leaves:List[int])->Optional[List[Tuple[int, int]]]:
+    '''
+    Smallest edge list over all discrete colorings reached by refining and individualizing one node
+    of the smallest color class at a time, or None once more than leaves[0] of them were tried
+    '''
+    color = refine_colors(graph, preds, color)
+    classes = defaultdict(list)
+    for n, c in color.items():
+        classes[c].append(n)
+    cells = [c for c, members in classes.items() if len(members) > 1]
+    if not cells:
+        leaves[0] -= 1
+        return sorted((color[n], color[s]) for n in graph.nodes for s in graph.edges[n])
+    cell = min(cells, key=lambda c: (len(classes[c]), c))
+    best = None
+    for n in classes[cell]:
+        if leaves[0] <= 0:
+            return None
+        individualized = {m:2*c for m, c in color.items()}
+        individualized[n] += 1
+        edges = canonical_edges(graph, preds, individualized, leaves)
+        if edges is None:
+            return None
+        if best is None or edges < best:
+            best = edges
+    return best
+
+
+def canonical_key(graph:Graph)->str:
+    '''
+    Returns a key that only depends on the structure of the graph, not the node names.
+    The key is the edge list under a canonical labeling found by Weisfeiler-Lehman refinement and,
+    for nodes refinement can't tell apart (e.g. in a plain cycle), individualization. If that takes
+    more than CANONICAL_MAX_LEAVES labelings, it falls back to the node names, which is still exact.
+    '''
+    preds = defaultdict(list)
+    for n, sinks in graph.edges.items():
+        for s in sinks:
+            preds[s].append(n)
+
+    edges = canonical_edges(graph, preds, {n:0 for n in graph.nodes}, [CANONICAL_MAX_LEAVES])
+    if edges is not None:
+        key = 'C{}:{}'.format(len(graph.nodes), edges)
+    else:
+        idx = {n:i for i, n in enumerate(graph.nodes)}
+        edges = sorted((idx[n], idx[s]) for n in graph.nodes for s in graph.edges[n])
+        key = 'L{}:{}'.format(graph2id(graph), edges)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+class CycleRankCache:
+    '''
+    Bounded LRU cache of cycle ranks keyed on canonical_key, optionally persisted to a file
+    so that sub-problems repeated across runs and related benchmarks are solved once.
+    '''
+    def __init__(self, maxsize:int=1000000)->None:
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def __contains__(self, key:str)->bool:
+        return key in self.entries
+
+    def __getitem__(self, key:str)->int:
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def __setitem__(self, key:str, value:int)->None:
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def load(self, path:Path)->None:
+        if path.is_file():
+            with path.open('rb') as f:
+                for key, value in pickle.load(f):
+                    self[key] = value
+
+    def save(self, path:Path)->None:
+        tmp_path = path.with_name(path.name + '.tmp')
+        with tmp_path.open('wb') as f:
+            pickle.dump(list(self.entries.items()), f)
+        tmp_path.replace(path)
+
+
+cycle_rank_cache = CycleRankCache()
+
+
 def compute_cycle_rank(g:Graph)->int:
     if not g.nodes:
         return 0
@@ -45,37 +159,41 @@ def compute_cycle_rank(g:Graph)->int:
         return max(scc_cycle_ranks)
 
 def compute_cycle_rank_caching(g:Graph)->int:
-    res = None
-    id_ = graph2id(g)
-    if id_ in cycle_rank_cache:
-        return cycle_rank_cache[id_]
+    '''
+    Cycle rank of g, the maximum over its SCCs. The cycle rank of each cyclic SCC is kept in
+    cycle_rank_cache under its canonical_key, so it's shared with isomorphic SCCs of other graphs
+    (and runs, with --cache-file).
+    '''
+    res = 0
+    for scc in get_scc_graphs(g):
+        if is_acyclic(scc):
+            continue
+        key = canonical_key(scc)
+        if key not in cycle_rank_cache:
+            cycle_rank_cache[key] = scc_cycle_rank(scc, dict())
+        res = max(res, cycle_rank_cache[key])
+    return res
 
-    if not g.nodes:
-        res = 0
-    elif is_acyclic(g):
-        res = 0
+def scc_cycle_rank(scc:Graph, memo:Dict[FrozenSet[str], int])->int:
+    '''
+    Cycle rank of a cyclic SCC. The subproblems are all induced subgraphs of the same graph,
+    so they're memoized on their node sets.
+    '''
+    key = frozenset(scc.nodes)
+    if key in memo:
+        return memo[key]
+    if len(scc.nodes) == 1:
+        # a single node with a cycle
+        res = 1
     else:
-        sccs = get_scc_graphs(g)
-        assert len(sccs) > 0
-
-        scc_cycle_ranks = []
-        for scc in sccs:
-            rm_node_cycle_ranks = []
-            if is_acyclic(scc):
-                scc_cycle_ranks.append(0)
-            elif len(scc.nodes) == 1:
-                # a single node with a cycle
-                scc_cycle_ranks.append(1)
-            else:
-                for n in scc.nodes:
-                    scc_m_n = deepcopy(scc)
-                    scc_m_n.rmNode(n)
-                    rm_node_cycle_ranks.append(compute_cycle_rank_caching(scc_m_n))
-                scc_cycle_ranks.append(1 + min(rm_node_cycle_ranks))
-        res = max(scc_cycle_ranks)
-
-    assert res is not None
-    cycle_rank_cache[id_] = res
+        rm_node_cycle_ranks = []
+        for n in scc.nodes:
+            scc_m_n = deepcopy(scc)
+            scc_m_n.rmNode(n)
+            rm_node_cycle_ranks.append(max([0] + [scc_cycle_rank(sub, memo) for sub in get_scc_graphs(scc_m_n)
+                                                  if not is_acyclic(sub)]))
+        res = 1 + min(rm_node_cycle_ranks)
+    memo[key] = res
     return res
 
 def compute_cycle_rank_iter(g:Graph)->int:
@@ -144,21 +262,194 @@ def compute_cycle_rank_iter(g:Graph)->int:
     return graph_cycle_rank[id_]
 
 
+def adjacency(g:Graph)->Dict[str, Set[str]]:
+    adj = {n:set() for n in g.nodes}
+    for n, sinks in g.edges.items():
+        adj[n].update(sinks)
+    return adj
+
+def sccs_of(nodes:Set[str], adj:Dict[str, Set[str]])->List[Set[str]]:
+    '''
+    Iterative Tarjan restricted to the subgraph induced by nodes
+    '''
+    index = dict()
+    lowlink = dict()
+    on_stack = set()
+    stack = []
+    sccs = []
+    counter = 0
+    for start in nodes:
+        if start in index:
+            continue
+        work = [(start, iter(adj[start] & nodes))]
+        index[start] = lowlink[start] = counter
+        counter += 1
+        stack.append(start)
+        on_stack.add(start)
+        while work:
+            n, it = work[-1]
+            pushed = False
+            for m in it:
+                if m not in index:
+                    index[m] = lowlink[m] = counter
+                    counter += 1
+                    stack.append(m)
+                    on_stack.add(m)
+                    work.append((m, iter(adj[m] & nodes)))
+                    pushed = True
+                    break
+                elif m in on_stack:
+                    lowlink[n] = min(lowlink[n], index[m])
+            if pushed:
+                continue
+            work.pop()
+            if work:
+                lowlink[work[-1][0]] = min(lowlink[work[-1][0]], lowlink[n])
+            if lowlink[n] == index[n]:
+                scc = set()
+                while True:
+                    m = stack.pop()
+                    on_stack.remove(m)
+                    scc.add(m)
+                    if m == n:
+                        break
+                sccs.append(scc)
+    return sccs
+
+def degree_choice(noise:float=0.0, rng:Optional[random.Random]=None)->Callable:
+    '''
+    Returns a function picking the node of an SCC with the most (in-degree * out-degree) inside it,
+    with multiplicative random noise for restarts
+    '''
+    def choose(scc:Set[str], adj:Dict[str, Set[str]])->str:
+        in_deg = defaultdict(int)
+        for n in scc:
+            for m in adj[n] & scc:
+                in_deg[m] += 1
+        def score(n):
+            val = in_deg[n] * len(adj[n] & scc)
+            return val * (1 + noise*rng.random()) if noise else val
+        return max(scc, key=score)
+    return choose
+
+def separator_choice(candidates:int=5)->Callable:
+    '''
+    Returns a function picking, among the highest degree nodes of an SCC, the one whose removal
+    leaves the smallest largest SCC (a single node separator in the spirit of nested dissection)
+    '''
+    by_degree = degree_choice()
+    def choose(scc:Set[str], adj:Dict[str, Set[str]])->str:
+        if len(scc) <= 2:
+            return by_degree(scc, adj)
+        in_deg = defaultdict(int)
+        for n in scc:
+            for m in adj[n] & scc:
+                in_deg[m] += 1
+        ranked = sorted(scc, key=lambda n: (in_deg[n] * len(adj[n] & scc), n), reverse=True)
+        return min(ranked[:candidates],
+                   key=lambda n: max(len(c) for c in sccs_of(scc - {n}, adj)))
+    return choose
+
+def cycle_rank_upper_bound(nodes:Set[str], adj:Dict[str, Set[str]], choose:Callable)->int:
+    '''
+    Cycle rank of the elimination order given by choose, an upper bound on the cycle rank
+    '''
+    res = 0
+    for scc in sccs_of(nodes, adj):
+        if len(scc) == 1:
+            n = next(iter(scc))
+            res = max(res, 1 if n in adj[n] else 0)
+        else:
+            n = choose(scc, adj)
+            res = max(res, 1 + cycle_rank_upper_bound(scc - {n}, adj, choose))
+    return res
+
+def cycle_rank_lower_bound(scc:Set[str], adj:Dict[str, Set[str]], size:int, rng:random.Random)->int:
+    '''
+    Exact cycle rank of a random connected induced subgraph with at most size nodes.
+    The cycle rank of a subgraph never exceeds the cycle rank of the graph.
+    '''
+    start = rng.choice(sorted(scc))
+    sample = {start}
+    frontier = set(adj[start] & scc)
+    while frontier and len(sample) < size:
+        n = rng.choice(sorted(frontier))
+        sample.add(n)
+        frontier.discard(n)
+        frontier.update((adj[n] & scc) - sample)
+    sub = Graph(list(sample))
+    for n in sample:
+        for m in adj[n] & sample:
+            sub.addEdge(n, m)
+    return compute_cycle_rank_caching(sub)
+
+def approx_cycle_rank(g:Graph, timeout:Optional[float]=None, max_sample:int=10, seed:int=0,
+                      report:Callable[[int, int], None]=lambda lo, hi: None)->Tuple[int, int]:
+    '''
+    Anytime bounds on the cycle rank. Starts from greedy elimination orders (upper) and a
+    single cycle (lower), then tightens them with randomized elimination orders and exact
+    cycle ranks of sampled subgraphs until they meet, the timeout expires, or SIGINT/SIGTERM.
+    report is called with (lower, upper) whenever the interval changes.
+    '''
+    adj = adjacency(g)
+    nodes = set(g.nodes)
+    sccs = [scc for scc in sccs_of(nodes, adj)
+            if len(scc) > 1 or next(iter(scc)) in adj[next(iter(scc))]]
+    lo = 1 if sccs else 0
+    hi = min(cycle_rank_upper_bound(nodes, adj, degree_choice()),
+             cycle_rank_upper_bound(nodes, adj, separator_choice()))
+    report(lo, hi)
+
+    stop = False
+    def handler(signum, frame):
+        nonlocal stop
+        stop = True
+    old_handlers = [(sig, signal.signal(sig, handler)) for sig in [signal.SIGINT, signal.SIGTERM]]
+
+    rng = random.Random(seed)
+    start = time.time()
+    size = 3
+    try:
+        while lo < hi and not stop and (timeout is None or time.time() - start < timeout):
+            choose = degree_choice(noise=1.0, rng=rng)
+            new_hi = cycle_rank_upper_bound(nodes, adj, choose)
+            # sample the large SCCs more often
+            scc = rng.choices(sccs, weights=[len(s) for s in sccs])[0]
+            new_lo = cycle_rank_lower_bound(scc, adj, size, rng)
+            size = size + 1 if size < max_sample else 3
+            if new_hi < hi or new_lo > lo:
+                hi = min(hi, new_hi)
+                lo = max(lo, new_lo)
+                report(lo, hi)
+    finally:
+        for sig, old in old_handlers:
+            signal.signal(sig, old)
+    return lo, hi
+
 
 if __name__ == "__main__":
     sys.setrecursionlimit(5000)
     parser = argparse.ArgumentParser("Read in pickle graph and compute cycle rank after removing self-loops for nodes")
     parser.add_argument('input_file', help='Pickled list of edges (.pkl)')
     parser.add_argument('-p', '--print-graph', action='store_true', help='Print the graph')
+    parser.add_argument('--approx', action='store_true',
+                        help='Report anytime lower and upper bounds instead of the exact cycle rank')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='Seconds to tighten the --approx bounds for (default: until they meet or Ctrl-C)')
+    parser.add_argument('--cache-file', default=None,
+                        help='File to load cycle ranks of previously seen subgraphs from and save them to')
+    parser.add_argument('--cache-size', type=int, default=1000000,
+                        help='Maximum number of SCC cycle ranks to keep in memory')
 
     args = parser.parse_args()
     input_file = Path(args.input_file)
+    cycle_rank_cache.maxsize = args.cache_size
+    if args.cache_file is not None:
+        cycle_rank_cache.load(Path(args.cache_file))
 
     nodes = set()
-    edges = pickle.load(input_file.open('rb'))
+    edges = [(node_name(n1), node_name(n2)) for n1, n2 in pickle.load(input_file.open('rb'))]
     for n1, n2 in edges:
-        n1 = str(n1)
-        n2 = str(n2)
         nodes.add(n1)
         nodes.add(n2)
     g = Graph(list(nodes))
@@ -173,6 +464,19 @@ if __name__ == "__main__":
         print_graph(g)
         print()
 
-    cycle_rank = compute_cycle_rank_caching(g)
-    assert cycle_rank >= 0, "Expecting a non-negative cycle rank"
-    print("Cycle rank is", cycle_rank)
+    try:
+        if args.approx:
+            lo, hi = approx_cycle_rank(g, args.timeout,
+                                       report=lambda lo, hi: print("Cycle rank in [{}, {}]".format(lo, hi), flush=True))
+            print("Cycle rank is", lo if lo == hi else "in [{}, {}]".format(lo, hi))
+        else:
+            # cycle rank of a graph is the max over its SCCs (self loops were skipped, so singletons are 0)
+            cond = load_condensation(g, input_file)
+            cycle_rank = max([0] + [compute_cycle_rank_caching(cond.scc_subgraph(g, i))
+                                    for i, size in enumerate(cond.sizes) if size > 1])
+            assert cycle_rank >= 0, "Expecting a non-negative cycle rank"
+            print("Cycle rank is", cycle_rank)
+    finally:
+        # the sampled subgraphs of --approx are cached too
+        if args.cache_file is not None:
+            cycle_rank_cache.save(Path(args.cache_file))
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+'''
+Estimates induction graph statistics from the dependencies of a sample of the invariant clauses,
+for proofs where computing the whole graph with gen_graph.py is infeasible:
+  out-degree: mean number of dependencies of a clause
+  in cycles:  fraction of clauses that (transitively) depend on themselves, among the sampled
+              clauses that were decided within the --cycle-budget
+  BFS depth:  distance from the property, a lower bound until the BFS completes
+Sampling stops after --samples clauses, --time-limit seconds or at Ctrl-C, and reports the
+estimates so far with confidence intervals.
+'''
+import argparse
+from collections import defaultdict, deque
+import math
+import random
+import signal
+from statistics import NormalDist
+import sys
+import time
+
+from cnf_utils import Clause, read_int_cnf
+from gen_graph import LazyInductionGraph, load_lazy_graph
+
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+
+def random_order(invs:List[Clause], rng:random.Random)->Iterator[Clause]:
+    order = list(invs)
+    rng.shuffle(order)
+    return iter(order)
+
+
+def stratified_order(invs:List[Clause], strata:Dict[Clause, int], rng:random.Random)->Iterator[Clause]:
+    '''
+    Samples every stratum once (largest first), then the one furthest behind its proportional share
+    '''
+    members = defaultdict(list)
+    for c in invs:
+        members[strata[c]].append(c)
+    for h in members:
+        rng.shuffle(members[h])
+    taken = dict((h, 0) for h in members)
+    for h in sorted(members, key=lambda h: -len(members[h])):
+        taken[h] += 1
+        yield members[h][0]
+    for n in range(len(members), len(invs)):
+        h = max((h for h in members if taken[h] < len(members[h])),
+                key=lambda h: len(members[h])*n/len(invs) - taken[h])
+        taken[h] += 1
+        yield members[h][taken[h] - 1]
+
+
+def stratified_mean(samples:Dict[int, List[float]], sizes:Dict[int, int])->Tuple[float, float]:
+    '''
+    Returns the estimated population mean and its variance, with finite population correction.
+    Strata with a single sample use the variance of all samples, strata without samples are left out.
+    '''
+    total = sum(sizes[h] for h in samples)
+    values = [v for vs in samples.values() for v in vs]
+    pooled_var = variance(values)
+    mean = 0.0
+    var = 0.0
+    for h, vs in samples.items():
+        w = sizes[h]/total
+        s2 = variance(vs) if len(vs) > 1 else pooled_var
+        mean += w*sum(vs)/len(vs)
+        var += w*w*s2/len(vs)*(1 - len(vs)/sizes[h])
+    return mean, var
+
+
+def variance(values:List[float])->float:
+    if len(values) < 2:
+        return 0.0
+    m = sum(values)/len(values)
+    return sum((v - m)**2 for v in values)/(len(values) - 1)
+
+
+def on_cycle(graph:LazyInductionGraph, inv:Clause, budget:Optional[int]=None,
+             stopped:Callable[[], bool]=lambda: False)->Optional[bool]:
+    '''
+    Searches the dependencies of inv (computing them as needed) for inv itself.
+    Returns None if that takes more than budget new dependency queries, or once stopped() is true.
+    '''
+    max_queries = None if budget is None else len(graph.memo) + budget
+    to_visit = deque(graph.deps(inv))
+    visited = set(to_visit)
+    while to_visit:
+        c = to_visit.popleft()
+        if c == inv:
+            return True
+        if c not in graph.memo and (stopped() or max_queries is not None and len(graph.memo) >= max_queries):
+            return None
+        for d in graph.deps(c):
+            if d not in visited:
+                visited.add(d)
+                to_visit.append(d)
+    return False
+
+
+def estimate_stats(graph:LazyInductionGraph, invs:List[Clause], order:Iterator[Clause],
+                   strata:Dict[Clause, int], max_samples:Optional[int]=None,
+                   time_limit:Optional[float]=None, cycle_budget:Optional[int]=None,
+                   report:Callable[[Dict], None]=lambda stats: None)->Dict:
+    '''
+    Samples clauses from order, alternating with expanding a BFS from the property (invs[0])
+    on the same memoized graph. report is called with the statistics after every sample.
+    SIGINT and SIGTERM stop sampling after the current dependency query, dropping an unfinished sample.
+    '''
+    sizes = defaultdict(int)
+    for c in invs:
+        sizes[strata[c]] += 1
+    degrees = defaultdict(list)
+    cycles = defaultdict(list)
+    num_undecided = 0
+    bfs = graph.explore([invs[0]])
+    bfs_done = False
+
+    stop = False
+    def handler(signum, frame):
+        nonlocal stop
+        stop = True
+    old_handlers = [(sig, signal.signal(sig, handler)) for sig in [signal.SIGINT, signal.SIGTERM]]
+
+    start = time.time()
+    num_samples = 0
+    stats = dict()
+    try:
+        for inv in order:
+            if stop or num_samples == max_samples or \
+               (time_limit is not None and time.time() - start >= time_limit):
+                break
+            h = strata[inv]
+            degree = len(graph.deps(inv))
+            cyclic = on_cycle(graph, inv, cycle_budget, lambda: stop)
+            if stop:
+                break
+            degrees[h].append(degree)
+            if cyclic is None:
+                num_undecided += 1
+            else:
+                cycles[h].append(1 if cyclic else 0)
+            num_samples += 1
+
+            # expand the BFS until it needs one new dependency query
+            num_queries = len(graph.memo)
+            while not bfs_done and not stop and len(graph.memo) == num_queries:
+                bfs_done = next(bfs, None) is None
+
+            stats = {'samples': num_samples, 'clauses': len(invs), 'queries': len(graph.memo),
+                     'out_degree': stratified_mean(degrees, sizes),
+                     'in_cycles': stratified_mean(cycles, sizes) if cycles else None,
+                     'undecided': num_undecided,
+                     'bfs_depth': max(graph.depths.values()), 'bfs_complete': bfs_done}
+            report(stats)
+    finally:
+        for sig, old in old_handlers:
+            signal.signal(sig, old)
+    return stats
+
+
+def format_stats(stats:Dict, confidence:float)->str:
+    z = NormalDist().inv_cdf((1 + confidence)/2)
+    lines = ['{} of {} clauses sampled, {} dependency queries'.format(stats['samples'], stats['clauses'],
+                                                                      stats['queries'])]
+    for name, key in [('out-degree', 'out_degree'), ('in cycles', 'in_cycles')]:
+        if stats[key] is None:
+            lines.append('{}: unknown'.format(name))
+            continue
+        mean, var = stats[key]
+        lines.append('{}: {:.3f} +- {:.3f} ({:g}% confidence)'.format(name, mean, z*math.sqrt(var),
+                                                                    100*confidence))
+    if stats['undecided']:
+        lines.append('({} sampled clauses not decided within the cycle budget)'.format(stats['undecided']))
+    lines.append('BFS depth from the property: {}{}'.format('' if stats['bfs_complete'] else '>= ',
+                                                             stats['bfs_depth']))
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate induction graph statistics by sampling clauses")
+    parser.add_argument('-t', dest="trans_filename", metavar='<TRANS_FILE>',
+                        help='The file with a CNF encoding of the transition relation')
+    parser.add_argument('-i', dest='invcand_filename', metavar='<INVCAND_FILE>',
+                        help='CNF of the invariant')
+    parser.add_argument('-ip', dest='invprime_cand_filename', metavar='<INVPRIMECAND_FILENAME>',
+                        help='primed CNF of the invariant')
+    parser.add_argument('--strategy', choices=['random', 'stratified'], default='stratified',
+                        help='Sample uniformly or stratified by clause length')
+    parser.add_argument('--samples', type=int, default=None, help='Maximum number of clauses to sample')
+    parser.add_argument('--time-limit', dest='time_limit', type=float, default=None,
+                        help='Seconds to sample for (default: until --samples or Ctrl-C)')
+    parser.add_argument('--cycle-budget', dest='cycle_budget', type=int, default=100,
+                        help='Maximum number of new dependency queries to decide whether a clause is in a cycle')
+    parser.add_argument('--confidence', type=float, default=0.95, help='Level of the confidence intervals')
+    parser.add_argument('--report-every', dest='report_every', type=int, default=10,
+                        help='Print the estimates every this many samples')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    graph, invs = load_lazy_graph(args.trans_filename, args.invcand_filename, args.invprime_cand_filename,
+                                  incremental=True)
+    lengths = [len(c) for c in read_int_cnf(args.invcand_filename)]
+    assert len(lengths) == len(invs)
+    if args.strategy == 'stratified':
+        # long clauses are rare, keep them in one stratum
+        strata = dict((c, min(l, 4)) for c, l in zip(invs, lengths))
+        order = stratified_order(invs, strata, random.Random(args.seed))
+    else:
+        strata = dict((c, 0) for c in invs)
+        order = random_order(invs, random.Random(args.seed))
+
+    def report(stats:Dict)->None:
+        if stats['samples'] % args.report_every == 0:
+            print(format_stats(stats, args.confidence), end='\n\n', flush=True)
+
+    stats = estimate_stats(graph, invs, order, strata, args.samples, args.time_limit, args.cycle_budget, report)
+    if not stats:
+        print('No clauses sampled')
+        sys.exit(1)
+    print(format_stats(stats, args.confidence))
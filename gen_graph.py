@@ -1,13 +1,22 @@
 #!/usr/bin/env python3
 import argparse
-from cnf_utils import read_cnf, assert_clauses, check_inductiveness, identify_invariants, Clause
-from collections import deque
+from cnf_utils import read_cnf, read_int_cnf, iter_int_cnf, int_clause_to_z3, assert_clauses, check_inductiveness, identify_invariants, Clause, \
+    read_concurrently, read_dump_archive
+from collections import defaultdict, deque
+from graph import Graph
+from graph_utils import label2idx
 from graphviz import Digraph
 from itertools import chain
-from marco import SubsetSolver, MapSolver, enumerate_sets
+import multiprocessing
+from pathlib import Path
+from marco import SubsetSolver, MapSolver, HittingSetSolver, enumerate_sets, smus
 import pickle
+from queue import Empty
+import random
 import sys
-from z3 import Solver, Not, And, sat, unsat, Implies, Bool
+import time
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
+from z3 import Solver, Not, And, Or, sat, unsat, unknown, Implies, Bool, is_true, set_param
 
 # This uses the z3 marco.py example
 # I was using it incorrectly because it assumed that SubsetSolvers were only instantiated once
@@ -35,9 +44,20 @@ from z3 import Solver, Not, And, sat, unsat, Implies, Bool
 #             deps.add(Clause(c))
 #     return deps
 
-def get_mus(constraints):
+# number of satisfiability checks made while shrinking, reported at the end of main
+num_solver_calls = 0
+# number of warm started queries and how many of them the warm start seed was unsat for
+num_warm_starts = 0
+num_warm_hits = 0
+
+def get_mus_idx(constraints, timeout=None, order=None):
     '''
-    Returns a single MUS
+    Returns the indices of a single MUS and whether it is approximate
+
+    With a timeout (in seconds) for the whole query, shrinking stops once it runs out
+    and the smallest unsat subset found so far is returned, marked as approximate
+    (it is still unsat but possibly not minimal).
+    order is the order to try removing constraints in (default: index order).
     '''
     seed = set(range(len(constraints)))
     idx2indicator = {i:Bool(str(i)) for i in seed}
@@ -47,33 +67,321 @@ def get_mus(constraints):
     for i, b in idx2indicator.items():
         s.add(Implies(b, constraints[i]))
 
+    deadline = None if timeout is None else time.time() + timeout
+
     def check_subset(current_seed):
+        '''
+        Returns None if the time budget ran out
+        '''
+        global num_solver_calls
+        num_solver_calls += 1
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            s.set('timeout', max(1, int(remaining*1000)))
         assumptions = [idx2indicator[i] for i in current_seed]
-        return (s.check(assumptions) == sat)
+        res = s.check(assumptions)
+        if res == unknown:
+            return None
+        return (res == sat)
+
+    def core_seed():
+        # FIXME: do constraints never show up in the core? Seems like we could get a key error
+        return set(indicator2idx[ind.get_id()] for ind in s.unsat_core())
 
     current = set(seed)
-    for i in seed:
+    approximate = False
+    if deadline is not None:
+        # start from z3's core so the fallback isn't the whole set
+        res = check_subset(current)
+        assert res is not True, "Expecting unsat"
+        if res is None:
+            return current, True
+        current = core_seed()
+
+    for i in (seed if order is None else order):
         if i not in current:
             continue
         current.remove(i)
-        if not check_subset(current):
-            core = s.unsat_core()
-            # FIXME: do constraints never show up in the core? Seems like we could get a key error
-            current = set(indicator2idx[ind.get_id()] for ind in core)
+        res = check_subset(current)
+        if res is None:
+            current.add(i)
+            approximate = True
+            break
+        elif not res:
+            current = core_seed()
         else:
             current.add(i)
-    assert not check_subset(current), "Expecting unsat at end of get_mus"
-    return [constraints[i] for i in current]
+    if not approximate:
+        assert not check_subset(current), "Expecting unsat at end of get_mus"
+    return current, approximate
+
+def get_mus(constraints, timeout=None):
+    '''
+    Returns a single MUS and whether it is approximate (see get_mus_idx)
+    '''
+    current, approximate = get_mus_idx(constraints, timeout)
+    return [constraints[i] for i in current], approximate
+
+def portfolio_config(k, n):
+    '''
+    The k-th solver configuration of the portfolio: a random seed and a constraint removal order
+    '''
+    order = list(range(n))
+    if k % 2 == 1:
+        order.reverse()
+    if k >= 2:
+        random.Random(k).shuffle(order)
+    return k, order
+
+def portfolio_worker(constraints, config, timeout, queue):
+    seed, order = config
+    set_param('smt.random_seed', seed)
+    set_param('sat.random_seed', seed)
+    current, approximate = get_mus_idx(constraints, timeout, order)
+    queue.put((sorted(current), approximate))
+
+# seconds between checks for portfolio workers that died without answering
+PORTFOLIO_POLL = 0.5
+
+def portfolio_mus(constraints, size, timeout=None):
+    '''
+    Runs get_mus_idx with size different configurations in separate (forked) processes
+    and returns the first exact answer, killing the other processes.
+    Workers that crash (or are killed, e.g. when out of memory) are skipped, if they all do
+    it raises a RuntimeError.
+    '''
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    procs = [ctx.Process(target=portfolio_worker,
+                         args=(constraints, portfolio_config(k, len(constraints)), timeout, queue))
+             for k in range(size)]
+    for p in procs:
+        p.start()
+    try:
+        best = None
+        num_answers = 0
+        while True:
+            try:
+                current, approximate = queue.get(timeout=PORTFOLIO_POLL)
+            except Empty:
+                num_failed = sum(1 for p in procs if p.exitcode not in (None, 0))
+                if num_answers + num_failed < size:
+                    continue
+                if best is None:
+                    raise RuntimeError('All {} portfolio workers failed'.format(size))
+                return best
+            num_answers += 1
+            if not approximate:
+                return (set(current), False)
+            if best is None or len(current) < len(best[0]):
+                best = (set(current), approximate)
+            if num_answers == size:
+                return best
+    finally:
+        for p in procs:
+            p.terminate()
+            p.join()
+
+def get_deps(constraints, npinv, timeout=None, portfolio=None, key=None):
+    '''
+    Returns the dependencies of npinv and whether they are approximate (see get_mus_idx)
 
-def get_deps(constraints, npinv):
+    portfolio is a (size, threshold) pair: queries that don't finish within threshold seconds
+    are restarted on a portfolio of size solver configurations.
+    key optionally sorts the constraint indices into the order to try removing them in.
+    '''
     constraints = constraints[:]
     constraints.append(npinv)
+    order = None if key is None else sorted(range(len(constraints)), key=key)
+
+    if portfolio is None:
+        mus, approximate = get_mus_idx(constraints, timeout, order)
+    else:
+        size, threshold = portfolio
+        start = time.time()
+        mus, approximate = get_mus_idx(constraints, threshold if timeout is None else min(threshold, timeout), order)
+        if approximate and (timeout is None or timeout > threshold):
+            remaining = None if timeout is None else timeout - (time.time() - start)
+            mus, approximate = portfolio_mus(constraints, size, remaining)
 
     deps = set()
-    for c in get_mus(constraints):
+    for i in mus:
+        c = constraints[i]
         if c.get_id() != npinv.get_id():
             deps.add(Clause(c))
-    return deps
+    return deps, approximate
+
+class GroupMUSSolver:
+    '''
+    Finds MUSes of a group of targets (negated primed clauses) on one incremental solver.
+    The soft constraints are guarded by indicators and the hard ones (trans) are always asserted.
+
+    One check of the disjunction of the targets gives a core that suffices for all of them,
+    every other constraint is needed by none, and each target is then shrunk within that core.
+    '''
+    def __init__(self, constraints, hard=None):
+        self.n = len(constraints)
+        self.indicators = [Bool('soft%i'%i) for i in range(self.n)]
+        self.indicator2idx = {b.get_id():i for (i,b) in enumerate(self.indicators)}
+        self.s = Solver()
+        for c in hard or []:
+            self.s.add(c)
+        for b, c in zip(self.indicators, constraints):
+            self.s.add(Implies(b, c))
+
+    def check_subset(self, seed, assumptions):
+        global num_solver_calls
+        num_solver_calls += 1
+        return self.s.check([self.indicators[i] for i in seed] + assumptions) == sat
+
+    def core_seed(self):
+        return set(self.indicator2idx[b.get_id()] for b in self.s.unsat_core()
+                   if b.get_id() in self.indicator2idx)
+
+    def shrink(self, seed, assumptions, key=None):
+        current = set(seed)
+        for i in sorted(seed, key=key):
+            if i not in current:
+                continue
+            current.remove(i)
+            if self.check_subset(current, assumptions):
+                current.add(i)
+            else:
+                current = self.core_seed()
+        return current
+
+    def group_core(self, selectors, support):
+        '''
+        Returns the core of the support for the disjunction of the selected targets
+        and the selectors of the targets the support doesn't imply
+        '''
+        remaining = list(selectors)
+        unsupported = set()
+        while remaining:
+            # a fresh group indicator per round, the previous ones are left unassumed
+            group = Bool('group%i'%len(unsupported))
+            self.s.add(Implies(group, Or(remaining)))
+            if not self.check_subset(support, [group]):
+                return self.core_seed(), unsupported
+            # the targets selected by the model are satisfiable with the whole support
+            model = self.s.model()
+            for t in remaining:
+                if is_true(model.eval(t, model_completion=True)):
+                    unsupported.add(t.get_id())
+            remaining = [t for t in remaining if t.get_id() not in unsupported]
+        return set(), unsupported
+
+    def group_mus(self, targets, hints:Optional[List[Optional[Set[int]]]]=None,
+                  keys:Optional[List[Optional[Callable[[int], Any]]]]=None,
+                  support:Optional[Set[int]]=None)->List[Optional[Set[int]]]:
+        '''
+        Returns the indices of an MUS for each target
+
+        hints optionally holds a warm start seed per target. If the seed is already unsat with
+        the target, the target is shrunk from its core instead of from the core of the group.
+        keys optionally holds the sort key of the order to try removing constraints in per target.
+        support optionally restricts the constraints to a subset, targets it doesn't imply get None.
+        '''
+        global num_warm_starts, num_warm_hits
+        self.s.push()
+        selectors = [Bool('target%i'%j) for j in range(len(targets))]
+        for t, target in zip(selectors, targets):
+            self.s.add(Implies(t, target))
+        if support is None:
+            support = set(range(self.n))
+
+        shared = None
+        muses = []
+        for j, t in enumerate(selectors):
+            hint = None if hints is None else hints[j]
+            key = None if keys is None else keys[j]
+            if hint is not None:
+                num_warm_starts += 1
+                if not self.check_subset(hint & support, [t]):
+                    num_warm_hits += 1
+                    muses.append(self.shrink(self.core_seed(), [t], key))
+                    continue
+            if shared is None:
+                shared, unsupported = self.group_core(selectors[j:], support)
+            if t.get_id() in unsupported:
+                muses.append(None)
+                continue
+            assert not self.check_subset(shared, [t]), "Expecting unsat"
+            muses.append(self.shrink(self.core_seed(), [t], key))
+        self.s.pop()
+        return muses
+
+ORDERS = ['index', 'length', 'overlap', 'distance', 'frequency']
+
+class DeletionOrder:
+    '''
+    Strategies for the order deletion based shrinking tries to remove invariant clauses in,
+    clauses that are less likely to be needed by the target first:
+      index:     position in the invariant file
+      length:    longest (weakest) clauses first
+      overlap:   clauses sharing the fewest variables with the target first
+      distance:  clauses farthest from the property in the BFS (or not reached yet) first
+      frequency: clauses that were dependencies of the fewest queries so far first
+    '''
+    def __init__(self, strategy:str, clause_vars:Dict[Clause, FrozenSet[int]],
+                 positions:Dict[Clause, int])->None:
+        assert strategy in ORDERS
+        self.strategy = strategy
+        self.clause_vars = clause_vars
+        self.positions = positions
+        # BFS distance of the clauses reached so far, set to LazyInductionGraph.depths
+        self.distance = dict()
+        self.frequency = defaultdict(int)
+
+    def key(self, target:Clause)->Optional[Callable[[Clause], Any]]:
+        '''
+        Returns the sort key for the query of target, None for index order
+        '''
+        if self.strategy == 'index':
+            return None
+        elif self.strategy == 'length':
+            rank = lambda c: -len(self.clause_vars[c])
+        elif self.strategy == 'overlap':
+            target_vars = self.clause_vars[target]
+            rank = lambda c: len(target_vars & self.clause_vars[c])
+        elif self.strategy == 'distance':
+            rank = lambda c: -self.distance.get(c, float('inf'))
+        else:
+            rank = lambda c: self.frequency[c]
+        # break ties by position
+        return lambda c: (rank(c), self.positions[c])
+
+    def record(self, deps:Set[Clause])->None:
+        for c in deps:
+            self.frequency[c] += 1
+
+# number of most recently found clauses sharing each variable that a query is warm started from
+WARM_START_NEIGHBOURS = 16
+
+# number of correction sets kept around for reuse by later --min-deps queries
+CS_CACHE_SIZE = 1000
+
+def get_min_deps(csolver, invs, npinv, cs_cache):
+    '''
+    Returns a smallest set of invariant clauses supporting npinv
+
+    csolver holds the invariant clauses as soft constraints and the transition relation as hard constraint.
+    cs_cache holds (MCS, model) pairs from previous queries. A model that also satisfies npinv
+    witnesses that its MCS is still a correction set for this query, so it seeds the hitting set solver.
+    '''
+    hsolver = HittingSetSolver(csolver.n)
+    for mcs, model in cs_cache:
+        if is_true(model.eval(npinv, model_completion=True)):
+            hsolver.add_set(mcs)
+
+    csolver.s.push()
+    csolver.s.add(npinv)
+    SMUS = smus(csolver, hsolver, cs_cache)
+    csolver.s.pop()
+    assert SMUS is not None, "Expecting unsat"
+    return set(invs[i] for i in SMUS), False
 
 def check_single_inv_induction(solver, inv, npinv):
     # assumes the transition relation has already been added
@@ -85,6 +393,270 @@ def check_single_inv_induction(solver, inv, npinv):
     solver.pop()
     return res
 
+def make_find_deps(z3trans, invs:List[Clause], min_deps:bool=False, timeout:Optional[float]=None,
+                   portfolio:Optional[Tuple[int, float]]=None)->Callable:
+    '''
+    Returns a function from a negated primed clause to the clauses (possibly including trans) it depends on
+    and whether they are approximate. The timeout (in seconds per query) and portfolio (see get_deps)
+    don't apply to min_deps.
+    '''
+    if min_deps:
+        csolver = SubsetSolver([inv._expr for inv in invs], hard=[z3trans])
+        cs_cache = deque(maxlen=CS_CACHE_SIZE)
+        def find_min_deps(npinv, key:Optional[Callable[[Clause], Any]]=None):
+            # every MUS is explored, so the deletion order doesn't matter
+            return get_min_deps(csolver, invs, npinv, cs_cache)
+        return find_min_deps
+    else:
+        constraints = [z3trans]
+        for inv in invs:
+            constraints.append(inv._expr)
+        def find_deps(npinv, key:Optional[Callable[[Clause], Any]]=None):
+            # trans and the target are tried last
+            idx_key = None if key is None else \
+                lambda i: (0, key(invs[i-1])) if 0 < i <= len(invs) else (1, i)
+            return get_deps(constraints, npinv, timeout, portfolio, idx_key)
+        return find_deps
+
+def make_find_group_deps(z3trans, invs:List[Clause])->Callable:
+    '''
+    Returns a function from a list of negated primed clauses (and optionally a set of clauses
+    to warm start from and a DeletionOrder key for each) to the clauses each one depends on
+    '''
+    gsolver = GroupMUSSolver([inv._expr for inv in invs], hard=[z3trans])
+    inv2idx = {inv:i for i, inv in enumerate(invs)}
+
+    def find_group_deps(npinvs, hints:Optional[List[Optional[Set[Clause]]]]=None,
+                        keys:Optional[List[Optional[Callable[[Clause], Any]]]]=None)->List[Set[Clause]]:
+        if hints is not None:
+            hints = [None if h is None else set(inv2idx[c] for c in h if c in inv2idx) for h in hints]
+        if keys is not None:
+            keys = [None if k is None else (lambda k: lambda i: k(invs[i]))(k) for k in keys]
+        muses = gsolver.group_mus(npinvs, hints, keys)
+        assert all(mus is not None for mus in muses), "Expecting unsat"
+        return [set(invs[i] for i in mus) for mus in muses]
+
+    return find_group_deps
+
+class LazyInductionGraph:
+    '''
+    Dependencies of invariant clauses, computed on demand and memoized.
+    compute_deps maps a clause to the set of clauses it depends on, excluding trans and itself.
+    With a batch_size > 1, compute_group maps a list of clauses to their dependencies and explore
+    computes those of up to batch_size clauses of the frontier at once.
+    '''
+    def __init__(self, compute_deps:Callable[[Clause], Set[Clause]],
+                 compute_group:Optional[Callable[[List[Clause]], List[Set[Clause]]]]=None,
+                 batch_size:int=1)->None:
+        self.compute_deps = compute_deps
+        self.compute_group = compute_group
+        self.batch_size = batch_size
+        self.memo = dict()
+        # the clause each clause was first found as a dependency of
+        self.parents = dict()
+        # the distance from the roots each clause was first found at
+        self.depths = dict()
+
+    def deps(self, inv:Clause)->Set[Clause]:
+        if inv not in self.memo:
+            self.memo[inv] = self.compute_deps(inv)
+        return self.memo[inv]
+
+    def explore(self, roots:List[Clause], max_depth:Optional[int]=None)->Iterator[Tuple[Clause, Clause]]:
+        '''
+        Breadth first search from the roots yielding (clause, dependency) edges.
+        Clauses max_depth away from the roots are not expanded, so their dependencies are never computed.
+        '''
+        to_visit = deque((r, 0) for r in roots)
+        for r in roots:
+            self.depths.setdefault(r, 0)
+        visited = set()
+        while to_visit:
+            inv, depth = to_visit.popleft()
+            if inv in visited:
+                continue
+            visited.add(inv)
+            if max_depth is not None and depth >= max_depth:
+                continue
+            if self.batch_size > 1 and inv not in self.memo:
+                self.prefetch(inv, to_visit, visited, max_depth)
+            for d in self.deps(inv):
+                yield inv, d
+                self.parents.setdefault(d, inv)
+                self.depths.setdefault(d, depth + 1)
+                if d not in visited:
+                    to_visit.append((d, depth + 1))
+
+    def prefetch(self, inv:Clause, to_visit:deque, visited:Set[Clause], max_depth:Optional[int])->None:
+        # inv and the next clauses of the frontier that will be expanded
+        group = [inv]
+        for n, depth in to_visit:
+            if len(group) >= self.batch_size:
+                break
+            if n in visited or n in self.memo or n in group:
+                continue
+            if max_depth is not None and depth >= max_depth:
+                continue
+            group.append(n)
+        for n, deps in zip(group, self.compute_group(group)):
+            self.memo[n] = deps
+
+def load_lazy_graph(trans_filename:str, inv_filename:str, invprime_filename:str,
+                    min_deps:bool=False, incremental:bool=False)->Tuple[LazyInductionGraph, List[Clause]]:
+    '''
+    Python API for interactive exploration, e.g.
+      g, invs = load_lazy_graph('trans.cnf', 'inv.cnf', 'inv-primed.cnf')
+      edges = list(g.explore([invs[0]], max_depth=3))
+    Returns the graph and the invariant clauses in file order (the property first).
+    With incremental, all queries run on one GroupMUSSolver (not supported with min_deps).
+    '''
+    inv_cand = read_cnf(inv_filename)
+    inv_primed_cand = read_cnf(invprime_filename)
+    inv2pinv = dict(zip(inv_cand, inv_primed_cand))
+    z3trans = And([int_clause_to_z3(c) for c in iter_int_cnf(trans_filename)])
+    clause_trans = Clause(z3trans)
+    if incremental:
+        assert not min_deps, "incremental is not supported with min_deps"
+        find_group_deps = make_find_group_deps(z3trans, inv_cand)
+        find_deps = lambda npinv: (find_group_deps([npinv])[0], False)
+    else:
+        find_deps = make_find_deps(z3trans, inv_cand, min_deps)
+
+    def compute_deps(inv:Clause)->Set[Clause]:
+        invdeps, _ = find_deps(Not(inv2pinv[inv]._expr))
+        invdeps.discard(clause_trans)
+        invdeps.discard(inv)
+        return invdeps
+
+    return LazyInductionGraph(compute_deps), inv_cand
+
+def load_prev_deps(graph_filename:str, inv_filename:str)->Dict[FrozenSet[int], List[FrozenSet[int]]]:
+    '''
+    Reads the dependencies of a previous run (pickled edges and the invariant it was generated from)
+    keyed on the literals of each clause, so they can be matched with a new invariant.
+    '''
+    prev_inv = [frozenset(c) for c in read_int_cnf(inv_filename)]
+    with open(graph_filename, 'rb') as f:
+        edges = pickle.load(f)
+    prev_deps = dict()
+    for src, dst in edges:
+        prev_deps.setdefault(prev_inv[label2idx(src)], []).append(prev_inv[label2idx(dst)])
+        # visited clauses without dependencies only show up as sinks
+        prev_deps.setdefault(prev_inv[label2idx(dst)], [])
+    return prev_deps
+
+def reuse_deps(solver, inv:Clause, npinv, prev_deps:Dict[FrozenSet[int], List[FrozenSet[int]]],
+               clause2key:Dict[Clause, FrozenSet[int]], key2clause:Dict[FrozenSet[int], Clause])->Optional[Set[Clause]]:
+    '''
+    Returns the dependencies of inv from the previous run if they are all still in the invariant
+    and still support inv, shrunk to a minimal set with one query per dependency, otherwise None.
+    '''
+    key = clause2key[inv]
+    if key not in prev_deps or any(d not in key2clause for d in prev_deps[key]):
+        return None
+    deps = set(key2clause[d] for d in prev_deps[key])
+    # the previous MUS could have contained inv itself, which is not recorded as an edge
+    def supported(deps:Set[Clause])->bool:
+        return check_single_inv_induction(solver, And([inv._expr] + [d._expr for d in deps]), npinv)
+    if not supported(deps):
+        return None
+    # after a change to trans some of the dependencies can be redundant
+    for d in list(deps):
+        if supported(deps - {d}):
+            deps.discard(d)
+    return deps
+
+def frame_graphs(z3trans, frames:List[List[List[int]]], prime_mapping:Dict[int, int],
+                 batch_size:int=1)->Iterator[Tuple[int, List[Tuple[str, str]], List[str], int, float]]:
+    '''
+    Induction graphs of a sequence of IC3 frames F_1, ..., F_N given as integer clauses.
+    The clauses of F_k depend on clauses of F_{k-1} (relative induction), those of F_1 on F_1 itself.
+    Clauses are labeled with their position in the union of the frames, in order of appearance.
+
+    All frames share one GroupMUSSolver over the union of their clauses. The frames are processed
+    from the last one and since frame clause sets are nested (F_k is a subset of F_{k-1}), an MUS found
+    for a clause within F_{k-1} is still an MUS within the larger F_{k-2} and is reused.
+
+    Yields the frame number, edges, labels of the clauses the support doesn't imply,
+    the number of reused dependencies and the runtime of each frame.
+    '''
+    from check_inv import prime_int_clause
+
+    key2idx = dict()
+    clauses = []
+    for frame in frames:
+        for c in frame:
+            if frozenset(c) not in key2idx:
+                key2idx[frozenset(c)] = len(clauses)
+                clauses.append(c)
+    frame_idxs = [[key2idx[frozenset(c)] for c in frame] for frame in frames]
+
+    gsolver = GroupMUSSolver([int_clause_to_z3(c) for c in clauses], hard=[z3trans])
+    npinvs = [Not(int_clause_to_z3(prime_int_clause(c, prime_mapping))) for c in clauses]
+    known_deps = dict()
+
+    for k in reversed(range(len(frames))):
+        start_time = time.time()
+        support = set(frame_idxs[max(0, k-1)])
+        num_reused = 0
+        todo = []
+        for i in frame_idxs[k]:
+            if i in known_deps and known_deps[i] <= support:
+                num_reused += 1
+            else:
+                todo.append(i)
+
+        unsupported = []
+        for start in range(0, len(todo), batch_size):
+            batch = todo[start:start+batch_size]
+            muses = gsolver.group_mus([npinvs[i] for i in batch], support=support)
+            for i, mus in zip(batch, muses):
+                if mus is None:
+                    unsupported.append(str(i))
+                    known_deps.pop(i, None)
+                else:
+                    known_deps[i] = mus
+
+        edges = []
+        for i in frame_idxs[k]:
+            if i in known_deps:
+                # don't have self loops
+                edges.extend((str(i), str(d)) for d in sorted(known_deps[i]) if d != i)
+        yield k + 1, edges, unsupported, num_reused, time.time() - start_time
+
+def clause_graph(edges:List[Tuple[str, str]])->Graph:
+    '''
+    The graph of labeled edges over clause indices (see label2idx), so the property is a single node '0'
+    '''
+    idx_edges = [(str(label2idx(n1)), str(label2idx(n2))) for n1, n2 in edges]
+    g = Graph(list(set(n for e in idx_edges for n in e)))
+    for n1, n2 in idx_edges:
+        g.addEdge(n1, n2)
+    return g
+
+def reduce_edges(edges:List[Tuple[str, str]])->List[Tuple[str, str]]:
+    '''
+    Drops the edges between SCCs that are implied by a longer path, keeping the order and labels of the rest
+    '''
+    from condensation import Condensation, reduce_graph
+    from graph_utils import get_sccs
+    g = clause_graph(edges)
+    reduced = reduce_graph(g, Condensation(g, get_sccs(g)))
+    kept = set((src, sink) for src in reduced.nodes for sink in reduced.edges[src])
+    reduced_edges = [(n1, n2) for n1, n2 in edges if (str(label2idx(n1)), str(label2idx(n2))) in kept]
+    print('Transitive reduction kept {}/{} edges'.format(len(reduced_edges), len(edges)))
+    return reduced_edges
+
+def write_dot(outname:str, edges:List[Tuple[str, str]], dashed:Set[str]=set())->None:
+    print('Writing graph to {}.dot'.format(outname))
+    f = open('%s.dot'%outname, 'w')
+    f.write('// Induction Graph of %s\ndigraph{\n'%outname)
+    for n1, n2 in edges:
+        # edges of approximate dependencies are dashed
+        f.write("  {} -> {}{}\n".format(n1, n2, " [style=dashed]" if n1 in dashed else ""))
+    f.write("}")
+    f.close()
+
 def debug_printing(inv2pinv, trans, prop, include_mapping=True):
     print('+++++++++++++++++++++++ debug printing +++++++++++++++++++++++++++')
     print('trans id =', trans._id)
@@ -95,6 +667,52 @@ def debug_printing(inv2pinv, trans, prop, include_mapping=True):
             print("{} --> {}".format(inv._id, pinv._id))
     print('+++++++++++++++++++++ end debug printing +++++++++++++++++++++++++')
 
+def read_inputs(args)->Tuple[Iterable[List[int]], List[List[int]], List[List[int]]]:
+    '''
+    The integer clauses of trans, the invariant and the primed invariant, from --archive
+    or from the -t, -i and -ip files (which can also be named pipes or '-' for stdin)
+    '''
+    if args.archive is not None:
+        dump = read_dump_archive(args.archive)
+        return dump['trans'], dump['inv'], dump['inv-primed']
+    return read_concurrently([(iter_int_cnf, args.trans_filename),
+                              (read_int_cnf, args.invcand_filename),
+                              (read_int_cnf, args.invprime_cand_filename)])
+
+def main_frames(args):
+    from check_inv import read_int_prime_mapping
+    if args.archive is not None:
+        dump = read_dump_archive(args.archive)
+        trans, prime_mapping = dump['trans'], dict(dump['mapping'])
+        frames = read_concurrently([(read_int_cnf, fn) for fn in args.frames])
+    else:
+        assert args.primes is not None, "Expecting --primes with --frames"
+        inputs = read_concurrently([(iter_int_cnf, args.trans_filename),
+                                    (read_int_prime_mapping, args.primes)] +
+                                   [(read_int_cnf, fn) for fn in args.frames])
+        trans, prime_mapping, frames = inputs[0], inputs[1], inputs[2:]
+    z3trans = And([int_clause_to_z3(c) for c in trans])
+
+    print('Finding dependencies of {} frames...'.format(len(frames)))
+    print('frame\tclauses\tedges\tunsupported\treused\tsolver calls\ttime')
+    prev_calls = num_solver_calls
+    for k, edges, unsupported, num_reused, runtime in \
+            frame_graphs(z3trans, frames, prime_mapping, args.batch_size):
+        print('{}\t{}\t{}\t{}\t{}\t{}\t{:.2f}'.format(k, len(frames[k-1]), len(edges), len(unsupported),
+                                                     num_reused, num_solver_calls - prev_calls, runtime))
+        prev_calls = num_solver_calls
+        outname = '{}-frame{}'.format(args.outname, k)
+        if args.reduce:
+            edges = reduce_edges(edges)
+        if args.gen_pickle:
+            with open('%s.pkl'%outname, 'wb') as f:
+                pickle.dump(edges, f)
+        if unsupported:
+            # nothing in the previous frame implies these, write them like approximate clauses
+            with open('%s.unsupported'%outname, 'w') as f:
+                f.write('\n'.join(unsupported) + '\n')
+        write_dot(outname, edges)
+
 def main():
     parser = argparse.ArgumentParser(description="Finds the induction "
                                      "graph for a proof of correctness "
@@ -108,6 +726,10 @@ def main():
     parser.add_argument('-ip', dest='invprime_cand_filename',
                         metavar='<INVPRIMECAND_FILENAME>',
                         help='primed CNF of candidate invaraiants from an IC3 frame')
+    parser.add_argument('--archive', dest='archive', default=None,
+                        metavar='<DUMP_ARCHIVE>',
+                        help='A tar archive (or - for stdin) with the dumped files, read as it is written, '
+                        'instead of -t, -i and -ip')
     parser.add_argument('-o', dest='outname', default='out',
                         metavar='<OUTPUT_FILE>',
                         help='Filename to write the graphviz graph to.')
@@ -115,13 +737,116 @@ def main():
                         help='Generate a pickle file of the edges.')
     parser.add_argument('--noprop', dest='noprop', action="store_true",
                         help='Don\'t include prop in invariants')
+    parser.add_argument('--prev-graph', dest='prev_graph', default=None,
+                        metavar='<PREV_PICKLE>',
+                        help='Pickled edges of a previous run to reuse dependencies from (requires --prev-inv)')
+    parser.add_argument('--prev-inv', dest='prev_inv', default=None,
+                        metavar='<PREV_INV_FILE>',
+                        help='CNF of the invariant the previous graph was generated from')
+    parser.add_argument('--min-deps', dest='min_deps', action="store_true",
+                        help='Find a smallest (SMUS) rather than an arbitrary set of dependencies.')
+    parser.add_argument('--roots', dest='roots', default='0',
+                        metavar='<ROOTS>',
+                        help='Semicolon delimited positions of the clauses to start from (default: the property)')
+    parser.add_argument('--max-depth', dest='max_depth', type=int, default=None,
+                        metavar='<DEPTH>',
+                        help='Only find dependencies of clauses less than this many edges from the roots')
+    parser.add_argument('--query-timeout', dest='query_timeout', type=float, default=None,
+                        metavar='<SECONDS>',
+                        help='Time budget per dependency query, after which the (possibly non-minimal) '
+                        'dependencies found so far are used and marked as approximate')
+    parser.add_argument('--portfolio', dest='portfolio', type=int, default=0,
+                        metavar='<SIZE>',
+                        help='Restart slow dependency queries on this many solver configurations in parallel')
+    parser.add_argument('--portfolio-threshold', dest='portfolio_threshold', type=float, default=10,
+                        metavar='<SECONDS>',
+                        help='Time after which a query is restarted on the portfolio')
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=1,
+                        metavar='<SIZE>',
+                        help='Find the dependencies of this many frontier clauses together on one incremental solver')
+    parser.add_argument('--warm-start', dest='warm_start', action="store_true",
+                        help='Start shrinking from the dependencies already found for related clauses '
+                        '(the BFS parent and clauses sharing variables) if they suffice')
+    parser.add_argument('--order', dest='order', choices=ORDERS, default='index',
+                        help='The order to try removing clauses in while shrinking (see DeletionOrder)')
+    parser.add_argument('--frames', dest='frames', nargs='+', default=None,
+                        metavar='<FRAME_FILE>',
+                        help='CNFs of the IC3 frames F_1 ... F_N, writes one graph per frame '
+                        '(<OUTPUT_FILE>-frame<k>) instead of using -i and -ip (requires --primes or --archive)')
+    parser.add_argument('--primes', dest='primes', default=None,
+                        metavar='<MAPPING_FILE>',
+                        help='Space delimited mapping from current to next state variables, for --frames')
+    parser.add_argument('--stats', dest='stats', default=None,
+                        metavar='<STATS_FILE>',
+                        help='Add the graph metrics and runtime to this .npz statistics store (see corpus_stats.py)')
+    parser.add_argument('--reduce', dest='reduce', action="store_true",
+                        help='Drop edges between SCCs that are implied by a longer path before writing the graph')
     args = parser.parse_args()
-    trans = read_cnf(args.trans_filename)
-    inv_cand = read_cnf(args.invcand_filename)
-    inv_primed_cand = read_cnf(args.invprime_cand_filename)
+    if args.frames is not None:
+        main_frames(args)
+        return
+    trans_ints, inv_ints, inv_primed_ints = read_inputs(args)
+    inv_cand = [Clause(int_clause_to_z3(c)) for c in inv_ints]
+    inv_primed_cand = [Clause(int_clause_to_z3(c)) for c in inv_primed_ints]
     outname = args.outname
     gen_pickle = args.gen_pickle
     noprop = args.noprop
+    min_deps = args.min_deps
+    batch_size = args.batch_size
+    warm_start = args.warm_start
+    # both run on one incremental GroupMUSSolver
+    use_group = batch_size > 1 or warm_start
+    assert not min_deps or args.order == 'index', "--order is not supported with --min-deps"
+    if use_group:
+        assert not min_deps and args.query_timeout is None and args.portfolio == 0, \
+            "--batch-size and --warm-start are not supported with --min-deps, --query-timeout or --portfolio"
+
+    prev_deps = None
+    num_reused = 0
+    if args.prev_graph is not None:
+        assert args.prev_inv is not None, "Expecting --prev-inv with --prev-graph"
+        assert not noprop, "Reusing a previous graph is not supported with --noprop"
+        prev_deps = load_prev_deps(args.prev_graph, args.prev_inv)
+        inv_keys = [frozenset(c) for c in inv_ints]
+        assert len(inv_keys) == len(inv_cand)
+        clause2key = dict(zip(inv_cand, inv_keys))
+        key2clause = dict(zip(inv_keys, inv_cand))
+
+    clause_vars = dict(zip(inv_cand, (frozenset(abs(l) for l in c)
+                                      for c in inv_ints)))
+    deletion_order = DeletionOrder(args.order, clause_vars, dict((c, i) for i, c in enumerate(inv_cand)))
+    if warm_start:
+        known_deps = dict()
+        var2known = defaultdict(list)
+
+    def warm_hint(inv:Clause, parent:Optional[Clause]=None)->Optional[Set[Clause]]:
+        '''
+        The clauses related to inv whose dependencies are known, their dependencies and inv itself.
+        Related are the BFS parent, the siblings (the other dependencies of the parent)
+        and the clauses that most recently shared a variable with inv.
+        '''
+        if not warm_start:
+            return None
+        related = []
+        if parent in known_deps:
+            related.append(parent)
+            related.extend(s for s in known_deps[parent] if s in known_deps)
+        for v in clause_vars[inv]:
+            related.extend(var2known[v][-WARM_START_NEIGHBOURS:])
+        if not related:
+            return None
+        hint = set([inv])
+        for r in related:
+            hint.add(r)
+            hint |= known_deps[r]
+        return hint
+
+    def record_deps(inv:Clause, invdeps:Set[Clause])->None:
+        deletion_order.record(invdeps)
+        if warm_start:
+            known_deps[inv] = invdeps
+            for v in clause_vars[inv]:
+                var2known[v].append(inv)
 
     # label each clause in the invariant with its position
     # zero is the property
@@ -140,83 +865,125 @@ def main():
 
     inv2pinv = dict(zip(inv_cand, inv_primed_cand))
 
-    z3trans = And([c._expr for c in trans])
+    # streamed from the file straight into z3 terms
+    z3trans = And([int_clause_to_z3(c) for c in trans_ints])
     clause_trans = Clause(z3trans)
 
     if not noprop:
         assert prop in inv2pinv
 
-    invs = inv2pinv.keys()
+    invs = list(inv2pinv.keys())
     pinvs = inv2pinv.values()
 
     print("Finding dependencies...")
-
-    constraints = [z3trans]
-    for inv in invs:
-        constraints.append(inv._expr)
+    start_time = time.time()
 
     ind_solver = Solver()
     ind_solver.add(z3trans)
 
+    portfolio = (args.portfolio, args.portfolio_threshold) if args.portfolio > 0 else None
+    find_deps = make_find_deps(z3trans, invs, min_deps, args.query_timeout, portfolio)
+    if use_group:
+        find_group_deps = make_find_group_deps(z3trans, invs)
+    # labels of the clauses whose dependencies are approximate
+    approx_labels = []
+
 #    debug_printing(inv2pinv, clause_trans, prop, include_mapping=True)
     edges = []
     if noprop:
-        for inv in invs:
-            pinv = inv2pinv[inv]
-            npinv = Not(pinv._expr)
-            invdeps = get_deps(constraints, npinv)
-            if clause_trans in invdeps:
-                invdeps.remove(clause_trans)
-            for d in invdeps:
-                edges.append((str(inv._id), str(d._id)))
+        for start in range(0, len(invs), batch_size):
+            batch = invs[start:start+batch_size]
+            npinvs = [Not(inv2pinv[inv]._expr) for inv in batch]
+            keys = [deletion_order.key(inv) for inv in batch]
+            if use_group:
+                hints = [warm_hint(inv) for inv in batch]
+                results = [(invdeps, False) for invdeps in find_group_deps(npinvs, hints, keys)]
+            else:
+                results = [find_deps(npinv, key) for npinv, key in zip(npinvs, keys)]
+            for inv, (invdeps, approximate) in zip(batch, results):
+                if approximate:
+                    approx_labels.append(str(inv._id))
+                if clause_trans in invdeps:
+                    invdeps.remove(clause_trans)
+                record_deps(inv, invdeps)
+                for d in invdeps:
+                    edges.append((str(inv._id), str(d._id)))
     else:
-        to_visit = deque([prop])
-        visited = set()
         count = 0
-        while to_visit:
+        def progress():
+            nonlocal count
             if count % 20 == 0:
                 print('#', end='')
                 sys.stdout.flush()
+            count += 1
 
-            inv = to_visit.pop()
-            pinv = inv2pinv[inv]
-
+        def reused_deps(inv:Clause)->Optional[Set[Clause]]:
+            nonlocal num_reused
+            if prev_deps is None:
+                return None
+            invdeps = reuse_deps(ind_solver, inv, Not(inv2pinv[inv]._expr), prev_deps, clause2key, key2clause)
+            if invdeps is not None:
+                num_reused += 1
+            return invdeps
+
+        def finish(inv:Clause, invdeps:Set[Clause])->Set[Clause]:
+            invdeps.discard(clause_trans) # trans is implicit
+            invdeps.discard(inv) # don't have self loops
+            return invdeps
+
+        def compute_deps(inv:Clause)->Set[Clause]:
+            if use_group:
+                return compute_group([inv])[0]
+            progress()
+            invdeps = reused_deps(inv)
+            if invdeps is None:
+                invdeps, approximate = find_deps(Not(inv2pinv[inv]._expr), deletion_order.key(inv))
+                if approximate:
+                    approx_labels.append(label(inv, True))
+            invdeps = finish(inv, invdeps)
+            record_deps(inv, invdeps)
+            return invdeps
+
+        def compute_group(group:List[Clause])->List[Set[Clause]]:
+            results = dict()
+            for inv in group:
+                progress()
+                invdeps = reused_deps(inv)
+                if invdeps is not None:
+                    results[inv] = invdeps
+            todo = [inv for inv in group if inv not in results]
+            if todo:
+                npinvs = [Not(inv2pinv[inv]._expr) for inv in todo]
+                hints = [warm_hint(inv, graph.parents.get(inv)) for inv in todo]
+                keys = [deletion_order.key(inv) for inv in todo]
+                for inv, invdeps in zip(todo, find_group_deps(npinvs, hints, keys)):
+                    results[inv] = invdeps
+            for inv in group:
+                record_deps(inv, finish(inv, results[inv]))
+            return [results[inv] for inv in group]
+
+        def label(inv:Clause, is_src:bool)->str:
             if inv == prop:
                 assert labels[inv._id] == 0
-                strinv = '0 (Prop)'
-            else:
-                strinv = str(labels[inv._id])
+                return '0 (Prop)' if is_src else '0 Prop'
+            return str(labels[inv._id])
 
-    #        print('visiting', inv._id, pinv._id)
-
-            if inv in visited:
-    #            print('skipping because already in visited')
-                continue
-            else:
-                visited.add(inv)
-                npinv = Not(pinv._expr)
-                invdeps = get_deps(constraints, npinv)
-    #            print("invdeps", [i._id for i in invdeps])
-                try:
-                    invdeps.remove(clause_trans)  # trans is implicit
-                except:
-                    pass
-                try:
-                    invdeps.remove(inv) # don't have self loops
-                except:
-                    pass
-                for d in invdeps:
-                    if d == prop:
-                        assert labels[d._id] == 0
-                        strd = '0 Prop'
-                    else:
-                        strd = str(labels[d._id])
-                    edges.append((strinv, strd))
-                    if d not in visited:
-                        to_visit.appendleft(d)
-            count += 1
+        roots = [inv_cand[int(r)] for r in args.roots.split(';')]
+        graph = LazyInductionGraph(compute_deps, compute_group, batch_size)
+        deletion_order.distance = graph.depths
+        for inv, d in graph.explore(roots, args.max_depth):
+            edges.append((label(inv, True), label(d, False)))
 
+    runtime = time.time() - start_time
     print()
+    if not min_deps:
+        print('Made {} solver calls'.format(num_solver_calls))
+    if warm_start:
+        print('Warm start seed sufficed for {}/{} queries'.format(num_warm_hits, num_warm_starts))
+    if prev_deps is not None:
+        print('Reused dependencies of {}/{} clauses from {}'.format(num_reused, count, args.prev_graph))
+    if args.reduce:
+        edges = reduce_edges(edges)
     # pickle the graph
     if gen_pickle:
         print('Pickling to %s.pkl'%outname)
@@ -225,13 +992,18 @@ def main():
         f.close()
     # end pickling the graph
 
-    print('Writing graph to {}.dot'.format(outname))
-    f = open('%s.dot'%outname, 'w')
-    f.write('// Induction Graph of %s\ndigraph{\n'%outname)
-    for n1, n2 in edges:
-        f.write("  {} -> {}\n".format(n1, n2))
-    f.write("}")
-    f.close()
+    if args.stats is not None:
+        from corpus_stats import append_metrics, graph_metrics
+        print('Adding statistics to {}'.format(args.stats))
+        metrics = graph_metrics(clause_graph(edges), '0', runtime, solver_calls=None if min_deps else num_solver_calls)
+        append_metrics(Path(args.stats), Path(outname).name, metrics)
+
+    if approx_labels:
+        print('Dependencies of {} clauses are approximate, writing them to {}.approx'.format(len(approx_labels), outname))
+        with open('%s.approx'%outname, 'w') as f:
+            f.write('\n'.join(approx_labels) + '\n')
+
+    write_dot(outname, edges, set(approx_labels))
 
 
     # dot = Digraph(comment="Induction Graph")
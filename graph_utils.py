@@ -2,8 +2,24 @@ from graph import Graph
 
 from collections import defaultdict, deque
 from copy import deepcopy
+import time
 
-from typing import Any, Dict, List, Optional, Set
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+
+def label2idx(label:str)->int:
+    # labels are the position in the invariant file, the property is labeled '0 (Prop)' or '0 Prop'
+    return int(label.split()[0])
+
+def node_name(label:Any)->str:
+    '''
+    The node of a pickled edge label. gen_graph labels the property '0 (Prop)' as a source and
+    '0 Prop' as a sink (see label2idx), older graphs label it 'Prop'; all of them become 'Prop'.
+    '''
+    label = str(label)
+    if label == 'Prop' or label2idx(label) == 0:
+        return 'Prop'
+    return str(label2idx(label))
 
 
 def is_acyclic(g_in:Graph):
@@ -89,6 +105,58 @@ def bfs(g:Graph, start:str)->Dict[str, Optional[str]]:
 
     return labeled_nodes
 
+def dominators(g:Graph, root:str)->Dict[str, Optional[str]]:
+    '''
+    Returns the immediate dominator of each node reachable from root (None for root): the last node
+    other than itself that every path from root to it goes through.
+    Uses the iterative algorithm of Cooper, Harvey and Kennedy.
+    '''
+    assert root in g.nodes, "Expecting root node to be in nodes"
+
+    # postorder of a DFS from root
+    postorder = []
+    visited = {root}
+    dfs_stack = [(root, iter(g.edges[root]))]
+    while dfs_stack:
+        n, sinks = dfs_stack[-1]
+        for dn in sinks:
+            if dn not in visited:
+                visited.add(dn)
+                dfs_stack.append((dn, iter(g.edges[dn])))
+                break
+        else:
+            dfs_stack.pop()
+            postorder.append(n)
+    position = {n: i for i, n in enumerate(postorder)}
+
+    preds = defaultdict(list)
+    for n in postorder:
+        for dn in g.edges[n]:
+            preds[dn].append(n)
+
+    def intersect(a:str, b:str)->str:
+        while a != b:
+            while position[a] < position[b]:
+                a = idom[a]
+            while position[b] < position[a]:
+                b = idom[b]
+        return a
+
+    idom = {root: root}
+    changed = True
+    while changed:
+        changed = False
+        for n in reversed(postorder[:-1]):
+            new_idom = None
+            for p in preds[n]:
+                if p in idom:
+                    new_idom = p if new_idom is None else intersect(p, new_idom)
+            if idom.get(n) != new_idom:
+                idom[n] = new_idom
+                changed = True
+    idom[root] = None
+    return idom
+
 def get_sccs(g:Graph)->List[Set[str]]:
     sccs = []
 
@@ -126,6 +194,190 @@ def get_scc_graphs(g:Graph)->List[Graph]:
         graphs.append(new_graph)
     return graphs
 
+def min_feedback_vertex_set(g:Graph, timeout:Optional[float]=None)->Tuple[Set[str], int]:
+    '''
+    Returns a feedback vertex set (nodes whose removal leaves g acyclic) and a lower bound on the
+    size of the smallest one. The set is minimum, i.e. the bound equals its size, unless the
+    timeout (in seconds) expired first.
+    Self loops are skipped like in cycle_rank.py, a clause depending on itself isn't interesting.
+    The graph is shrunk with reduce_fvs and split into SCCs until neither changes it, then each
+    remaining SCC is solved with z3, smallest first, sharing what is left of the timeout.
+    '''
+    succ = {n: set(g.edges[n]) - {n} for n in g.nodes}
+    pred = {n: set() for n in g.nodes}
+    for n in g.nodes:
+        for m in succ[n]:
+            pred[m].add(n)
+
+    fvs = set()
+    components = [(succ, pred)]
+    irreducible = []
+    while components:
+        succ, pred = components.pop()
+        reduce_fvs(succ, pred, fvs)
+        sccs = [scc for scc in get_sccs(adjacency_graph(succ)) if len(scc) > 1]
+        if len(sccs) == 1 and len(sccs[0]) == len(succ):
+            irreducible.append(succ)
+            continue
+        # edges between SCCs aren't on any cycle
+        for scc in sccs:
+            components.append(({n: succ[n] & scc for n in scc}, {n: pred[n] & scc for n in scc}))
+
+    lower = len(fvs)
+    start = time.time()
+    irreducible.sort(key=len)
+    for i, succ in enumerate(irreducible):
+        remaining = None
+        if timeout is not None:
+            remaining = max(0.0, timeout - (time.time() - start))/(len(irreducible) - i)
+        scc_fvs, scc_lower = solve_fvs(succ, remaining)
+        fvs.update(scc_fvs)
+        lower += scc_lower
+    return fvs, lower
+
+def adjacency_graph(succ:Dict[str, Set[str]])->Graph:
+    g = Graph(list(succ))
+    for n, sinks in succ.items():
+        for m in sinks:
+            g.addEdge(n, m)
+    return g
+
+def remove_node(succ:Dict[str, Set[str]], pred:Dict[str, Set[str]], n:str)->Set[str]:
+    '''
+    Removes n from the adjacency sets in place, returns its former neighbours
+    '''
+    for m in succ[n]:
+        pred[m].discard(n)
+    for m in pred[n]:
+        succ[m].discard(n)
+    neighbours = (succ.pop(n) | pred.pop(n)) - {n}
+    return neighbours
+
+def reduce_fvs(succ:Dict[str, Set[str]], pred:Dict[str, Set[str]], fvs:Set[str])->None:
+    '''
+    Applies the reductions of Levy and Low in place until none applies, which keeps the size of
+    a minimum feedback vertex set (not counting the nodes added to fvs):
+      nodes without predecessors or successors aren't on any cycle and are dropped
+      nodes with a self loop are in every feedback vertex set and are moved to fvs
+      a node with a single predecessor (successor) is merged into it, since every cycle through
+      the node also goes through that neighbour
+    '''
+    queue = deque(succ)
+    while queue:
+        n = queue.popleft()
+        if n not in succ:
+            continue
+        if n in succ[n]:
+            fvs.add(n)
+        elif not succ[n] or not pred[n]:
+            pass
+        elif len(pred[n]) == 1:
+            p = next(iter(pred[n]))
+            for m in succ[n]:
+                succ[p].add(m)
+                pred[m].add(p)
+        elif len(succ[n]) == 1:
+            m = next(iter(succ[n]))
+            for p in pred[n]:
+                succ[p].add(m)
+                pred[m].add(p)
+        else:
+            continue
+        queue.extend(remove_node(succ, pred, n))
+
+def greedy_fvs(succ:Dict[str, Set[str]])->Set[str]:
+    '''
+    Returns a feedback vertex set found by repeatedly taking the node with the most
+    (in-degree * out-degree), reducing in between
+    '''
+    succ = {n: set(sinks) for n, sinks in succ.items()}
+    pred = {n: set() for n in succ}
+    for n, sinks in succ.items():
+        for m in sinks:
+            pred[m].add(n)
+    fvs = set()
+    reduce_fvs(succ, pred, fvs)
+    while succ:
+        n = max(sorted(succ), key=lambda n: len(pred[n])*len(succ[n]))
+        fvs.add(n)
+        remove_node(succ, pred, n)
+        reduce_fvs(succ, pred, fvs)
+    return fvs
+
+def shortest_cycle(succ:Dict[str, Set[str]], nodes:Set[str], start:str)->Optional[List[str]]:
+    '''
+    Returns the nodes of a shortest cycle through start within nodes, or None
+    '''
+    parent = {start: None}
+    queue = deque([start])
+    while queue:
+        n = queue.popleft()
+        for m in succ[n]:
+            if m == start:
+                cycle = [n]
+                while parent[cycle[-1]] is not None:
+                    cycle.append(parent[cycle[-1]])
+                return cycle
+            if m in nodes and m not in parent:
+                parent[m] = n
+                queue.append(m)
+    return None
+
+def disjoint_cycles(succ:Dict[str, Set[str]], nodes:Set[str])->List[List[str]]:
+    '''
+    Greedily packs short node-disjoint cycles of the subgraph induced by nodes, none iff it's acyclic
+    '''
+    available = set(nodes)
+    cycles = []
+    for n in sorted(nodes):
+        if n in available:
+            cycle = shortest_cycle(succ, available, n)
+            if cycle is not None:
+                cycles.append(cycle)
+                available.difference_update(cycle)
+    return cycles
+
+def solve_fvs(succ:Dict[str, Set[str]], timeout:Optional[float]=None)->Tuple[Set[str], int]:
+    '''
+    Minimum feedback vertex set of a strongly connected graph as an implicit hitting set problem:
+    z3's Optimize finds a smallest set of nodes hitting the cycles found so far, then the cycles
+    left after removing it are added, until there are none. Each hitting set is a lower bound
+    and completing it greedily gives an upper bound, which are returned on timeout.
+    '''
+    from z3 import Bool, Not, Optimize, Or, is_true, sat
+
+    nodes = sorted(succ)
+    removed = dict((n, Bool('fvs%i'%i)) for i, n in enumerate(nodes))
+    opt = Optimize()
+    for n in nodes:
+        opt.add_soft(Not(removed[n]))
+    upper = greedy_fvs(succ)
+    lower = 0
+    hitting = set()
+    start = time.time()
+    while lower < len(upper):
+        rest = set(nodes) - hitting
+        cycles = disjoint_cycles(succ, rest)
+        if not cycles:
+            return hitting, len(hitting)
+        completed = hitting | greedy_fvs(dict((n, succ[n] & rest) for n in rest))
+        if len(completed) < len(upper):
+            upper = completed
+        for cycle in cycles:
+            opt.add(Or([removed[n] for n in cycle]))
+        if timeout is not None:
+            remaining = timeout - (time.time() - start)
+            if remaining <= 0:
+                break
+            opt.set('timeout', max(1, int(remaining*1000)))
+        if opt.check() != sat:
+            break
+        model = opt.model()
+        hitting = set(n for n in nodes if is_true(model.eval(removed[n], model_completion=True)))
+        lower = max(lower, len(hitting))
+    # the graph has a cycle, so at least one node has to go
+    return upper, max(1, lower)
+
 def print_graph(g:Graph)->None:
     for n in g.nodes:
         print(n, end=' => { ')
@@ -0,0 +1,71 @@
+'''
+Drop-in replacements for the traversals in graph_utils built on a sparse
+adjacency matrix, so they run at native speed on large graphs.
+Requires numpy and scipy.
+'''
+from graph import Graph
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, shortest_path
+
+from typing import Dict, List, Optional, Set, Tuple
+
+
+def to_csr(g:Graph)->Tuple[csr_matrix, Dict[str, int]]:
+    '''
+    Returns the adjacency matrix of the graph and the mapping from node to row/column
+    '''
+    node2idx = {n:i for i, n in enumerate(g.nodes)}
+    src = []
+    dst = []
+    for n, sinks in g.edges.items():
+        for s in sinks:
+            src.append(node2idx[n])
+            dst.append(node2idx[s])
+    data = np.ones(len(src), dtype=np.int8)
+    num_nodes = len(g.nodes)
+    mat = csr_matrix((data, (np.array(src, dtype=np.int64), np.array(dst, dtype=np.int64))),
+                     shape=(num_nodes, num_nodes))
+    return mat, node2idx
+
+
+def labels_to_sets(g:Graph, num:int, labels:np.ndarray)->List[Set[str]]:
+    components = [set() for _ in range(num)]
+    for n, l in zip(g.nodes, labels):
+        components[l].add(n)
+    return components
+
+
+def bfs(g:Graph, start:str)->Dict[str, Optional[int]]:
+    '''
+    Same as graph_utils.bfs: the distance from the start node for each node
+    in the graph, or None if it is unreachable.
+    '''
+    assert start in g.nodes, "Expecting start node to be in nodes"
+    mat, node2idx = to_csr(g)
+    dist = shortest_path(mat, directed=True, unweighted=True, indices=node2idx[start])
+    return {n:(int(d) if np.isfinite(d) else None) for n, d in zip(g.nodes, dist)}
+
+
+def get_sccs(g:Graph)->List[Set[str]]:
+    '''
+    Same partition into strongly connected components as graph_utils.get_sccs,
+    possibly in a different order (Condensation sorts them)
+    '''
+    if not g.nodes:
+        return []
+    mat, _ = to_csr(g)
+    num, labels = connected_components(mat, directed=True, connection='strong')
+    return labels_to_sets(g, num, labels)
+
+
+def get_wccs(g:Graph)->List[Set[str]]:
+    '''
+    Returns the weakly connected components of the graph
+    '''
+    if not g.nodes:
+        return []
+    mat, _ = to_csr(g)
+    num, labels = connected_components(mat, directed=True, connection='weak')
+    return labels_to_sets(g, num, labels)
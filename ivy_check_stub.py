@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+'''
+Stand-in for ivy_check to test scrape-from-ivy.py without Ivy installed:
+  ./scrape-from-ivy.py --ivy-check ./ivy_check_stub.py <file>.ivy
+
+Reads a JSON file (path given by the IVY_CHECK_STUB_DEPS environment variable) mapping
+each (zero-indexed) conjecture line number to a list of sufficient sets of conjecture
+line numbers. A conjecture passes if one of its sufficient sets is enabled in the checked
+file, either as a conjecture or an axiom. Failures are reported like ivy_check does.
+'''
+import json
+import os
+import sys
+
+if __name__ == "__main__":
+    filename = sys.argv[-1]
+    with open(os.environ['IVY_CHECK_STUB_DEPS']) as f:
+        deps = {int(k): [set(s) for s in v] for k, v in json.load(f).items()}
+
+    with open(filename) as f:
+        lines = f.read().split('\n')
+
+    enabled = set(i for i, line in enumerate(lines)
+                  if line.startswith('conjecture') or line.startswith('axiom'))
+    failed = [i for i in enabled if lines[i].startswith('conjecture')
+              and not any(s <= enabled for s in deps.get(i, [set()]))]
+
+    for i in failed:
+        print('{}: line {}: error: FAIL'.format(filename, i + 1))
+    sys.exit(1 if failed else 0)
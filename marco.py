@@ -78,12 +78,15 @@ class SubsetSolver:
    # varcache = {}
    # idcache = {}
 
-   def __init__(self, constraints):
+   def __init__(self, constraints, hard=None):
        self.constraints = constraints
        self.n = len(constraints)
        self.s = Solver()
        self.varcache = {}
        self.idcache = {}
+       # hard constraints are always asserted and never part of a seed
+       for h in hard or []:
+           self.s.add(h)
        for i in range(self.n):
            self.s.add(Implies(self.c_var(i), constraints[i]))
 
@@ -135,6 +138,22 @@ class SubsetSolver:
               current.pop()
        return current
 
+   def correction_set(self, seed):
+       """Grow a satisfiable seed to an MSS.
+            Returns:
+            The complement of the MSS (an MCS) and a model of the MSS.
+       """
+       current = list(seed)
+       assert self.check_subset(current), "Expecting a satisfiable seed"
+       model = self.s.model()
+       for i in self.complement(current):
+           current.append(i)
+           if self.check_subset(current):
+              model = self.s.model()
+           else:
+              current.pop()
+       return self.complement(current), model
+
 
 
 class MapSolver:
@@ -176,6 +195,56 @@ class MapSolver:
     
 
 
+class HittingSetSolver:
+   def __init__(self, n):
+       """Initialization.
+             Args:
+            n: The number of constraints to map.
+       """
+       self.solver = Optimize()
+       self.n = n
+       for i in range(n):
+           self.solver.add_soft(Not(Bool(str(i))))
+
+   def add_set(self, aset):
+       """Require every future hitting set to intersect the given set."""
+       self.solver.add( Or( [Bool(str(i)) for i in aset] ) )
+
+   def minimum_hitting_set(self):
+       """Get a minimum-cardinality hitting set of all sets added so far.
+            Returns:
+            A hitting set as an array of 0-based constraint indexes.
+       """
+       if self.solver.check() == unsat:
+            return None
+       model = self.solver.model()
+       return [i for i in range(self.n) if is_true(model.eval(Bool(str(i)), model_completion=True))]
+
+
+def smus(csolver, hsolver, correction_sets=None):
+    """Smallest MUS through implicit hitting set dualization.
+
+    Every MUS hits every MCS, so a minimum hitting set of the MCSes found so far
+    that is unsatisfiable is a smallest MUS. Otherwise it is grown into a new MCS
+    that the next hitting set has to intersect. Any (MCS, model) pairs found are
+    appended to correction_sets so they can be reused for related queries.
+    Returns None if the full set of constraints is satisfiable.
+    """
+    while True:
+        hs = hsolver.minimum_hitting_set()
+        if hs is None:
+           return None
+        if not csolver.check_subset(hs):
+           return hs
+        MCS, model = csolver.correction_set(hs)
+        if not MCS:
+           # the whole set of constraints is satisfiable
+           return None
+        if correction_sets is not None:
+           correction_sets.append((MCS, model))
+        hsolver.add_set(MCS)
+
+
 def enumerate_sets(csolver, map):
     """Basic MUS/MCS enumeration, as a simple example."""
     while True:
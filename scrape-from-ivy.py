@@ -1,30 +1,30 @@
+#!/usr/bin/env python3
+import argparse
+import multiprocessing
+import os.path
 import subprocess
+import tempfile
 import z3
-import ivy.ivy_lexer
-
-import sys, os.path
-INPUT = sys.argv[1]
-BASE_NAME = os.path.basename(INPUT)
-
-print 'Processing...', INPUT
-
-with open(INPUT) as f:
-    source = f.read().split('\n')
 
-conjecture_line_numbers = []
+IVY_CHECK = 'ivy_check'
+BASE_NAME = ''
 all_lines = []
+conjecture_line_numbers = []
 
-lines = enumerate(source)
-
-in_a_conjecture = False
-try:
-    while True:
-        i, line = lines.next()
+def parse_conjectures(source):
+    '''
+    Joins every multi-line conjecture onto its first line (the rest become '#' lines).
+    Returns the lines and the line numbers of the conjectures.
+    '''
+    conjecture_line_numbers = []
+    all_lines = []
+    in_a_conjecture = False
+    for i, line in enumerate(source):
         line = line.lstrip()
         if in_a_conjecture:
             BAD_WORDS = 'conjecture init individual object relation action'.split(' ')
             if any([line.startswith(word) for word in BAD_WORDS]) or '}' in line:
-#           if line.startswith('conjecture') or line.startswith('init') or ('}' in line):
+    #       if line.startswith('conjecture') or line.startswith('init') or ('}' in line):
                 in_a_conjecture = False
             else:
                 all_lines[conjecture_line_numbers[-1]] += ' ' + line.split('#')[0]
@@ -34,136 +34,204 @@ try:
             if line.startswith('conjecture'):
                 in_a_conjecture = True
                 conjecture_line_numbers.append(i)
-except StopIteration:
-    pass
-
-
-
-
-
-
-
-
-
-print 'The (zero-indexed) conjecture line numbers are:', conjecture_line_numbers
-
-def query(Pk, conjectures, axioms):
-    print 'Query:', Pk, conjectures, axioms
-    filename = 'test-' + str(Pk) + '-' + BASE_NAME
-    with open(filename, 'w') as f:
-        for i, line in enumerate(all_lines):
-            if i not in conjecture_line_numbers: # normal line of ivy
-                f.write(line + '\n')
-            elif i == Pk: # always include Pk as a conjecture
-                f.write(line + '\n')
-            elif i in axioms:
-                f.write(line.replace('conjecture', 'axiom') + '\n')
-            elif i in conjectures:
-                f.write(line + '\n')
-            else: #elif i not in axioms and i not in conjectures:
-                f.write('#' + line + '\n')
-    try:
-        out = subprocess.check_output(['ivy_check', 'complete=fo', filename])
-        return True
-    except subprocess.CalledProcessError as e:
-        err_lines = e.output.split('\n')
-        err_lines = [l for l in err_lines if 'FAIL' in l]
-        err_lines = [int(l.split(' line ')[1].split(':')[0]) - 1 for l in err_lines]
-        if err_lines == []:
-            print repr(e.output), ':('
-        if Pk in err_lines:
+    return all_lines, conjecture_line_numbers
+
+# memoized ivy_check results keyed on (Pk, conjectures, axioms)
+# replaced by a dictionary shared between the pool workers in init_worker
+query_cache = dict()
+
+def init_worker(shared_cache):
+    global query_cache
+    query_cache = shared_cache
+
+class MonotoneIndex:
+    '''
+    Results of earlier queries for a single Pk, stored as bitsets over the conjectures.
+    Any superset of a sufficient set is sufficient and any subset of an insufficient
+    set is insufficient, so only the minimal sufficient and maximal insufficient sets are kept.
+    '''
+    def __init__(self):
+        self.bit = {n: 1 << i for i, n in enumerate(conjecture_line_numbers)}
+        self.sufficient = []
+        self.insufficient = []
+        self.skipped = 0
+
+    def to_bits(self, conjectures):
+        bits = 0
+        for n in conjectures:
+            bits |= self.bit[n]
+        return bits
+
+    def lookup(self, bits):
+        if any(s & bits == s for s in self.sufficient):
+            return True
+        if any(s & bits == bits for s in self.insufficient):
             return False
-        return True
+        return None
+
+    def add(self, bits, res):
+        if res:
+            self.sufficient = [s for s in self.sufficient if s & bits != bits]
+            self.sufficient.append(bits)
+        else:
+            self.insufficient = [s for s in self.insufficient if s & bits != s]
+            self.insufficient.append(bits)
+
+def query(Pk, conjectures, axioms, index=None):
+    # Pk is always included as a conjecture
+    conjectures = set(conjectures) - {Pk}
+    if index is not None and not axioms:
+        bits = index.to_bits(conjectures)
+        res = index.lookup(bits)
+        if res is not None:
+            index.skipped += 1
+            return res
+    key = (Pk, frozenset(conjectures), frozenset(axioms))
+    if key in query_cache:
+        res = query_cache[key]
+    else:
+        res = run_ivy_check(Pk, conjectures, axioms)
+        query_cache[key] = res
+    if index is not None and not axioms:
+        index.add(bits, res)
+    return res
+
+def run_ivy_check(Pk, conjectures, axioms):
+    print('Query:', Pk, conjectures, axioms)
+    # every query gets its own directory so parallel workers never share files
+    with tempfile.TemporaryDirectory(prefix='ivy-') as tmpdir:
+        filename = os.path.join(tmpdir, 'test-' + str(Pk) + '-' + BASE_NAME)
+        with open(filename, 'w') as f:
+            for i, line in enumerate(all_lines):
+                if i not in conjecture_line_numbers: # normal line of ivy
+                    f.write(line + '\n')
+                elif i == Pk: # always include Pk as a conjecture
+                    f.write(line + '\n')
+                elif i in axioms:
+                    f.write(line.replace('conjecture', 'axiom') + '\n')
+                elif i in conjectures:
+                    f.write(line + '\n')
+                else: #elif i not in axioms and i not in conjectures:
+                    f.write('#' + line + '\n')
+        try:
+            subprocess.check_output([IVY_CHECK, 'complete=fo', filename],
+                                    cwd=tmpdir, universal_newlines=True)
+            return True
+        except subprocess.CalledProcessError as e:
+            err_lines = e.output.split('\n')
+            err_lines = [l for l in err_lines if 'FAIL' in l]
+            err_lines = [int(l.split(' line ')[1].split(':')[0]) - 1 for l in err_lines]
+            if err_lines == []:
+                print(repr(e.output), ':(')
+            if Pk in err_lines:
+                return False
+            return True
 
 
 def complement(seed):
     return set(conjecture_line_numbers) - set(seed)
 
-def shrink(Pk, seed):
+def shrink(Pk, seed, index=None):
     current = set(seed)
     for Pi in seed:
         current.remove(Pi)
-        #print 'Trying to shrink...', current
-        if not query(Pk, current, set()):
+        #print('Trying to shrink...', current)
+        if not query(Pk, current, set(), index):
             current.add(Pi)
     return current
 
-def grow(Pk, seed):
+def grow(Pk, seed, index=None):
     current = set(seed)
     for Pi in complement(seed):
         current.add(Pi)
-        #print 'Trying to grow...', current
-        if query(Pk, current, set()):
+        #print('Trying to grow...', current)
+        if query(Pk, current, set(), index):
             current.remove(Pi)
     return current
 
 
 def marco(Pk):
-    print 'Starting to think about...', Pk
+    print('Starting to think about...', Pk)
     solver = z3.Solver()
     P = []
     for line_number in conjecture_line_numbers:
         P.append(z3.Bool('P_' + str(line_number)))
     out = []
+    index = MonotoneIndex()
     while True:
         if solver.check() == z3.sat:
             m = solver.model()
             #seed = [conjecture_line_numbers[i] for i, Pi in enumerate(P) if m.eval(Pi, model_completion=True)]
             seed = [conjecture_line_numbers[i] for i, Pi in enumerate(P) if not z3.is_false(m[Pi])]
-            #print 'Got seed:', seed
-            if query(Pk, set(seed), set()):
-                seed = shrink(Pk, seed)
-                #print 'Shrank to:', seed, 'which works'
+            #print('Got seed:', seed)
+            if query(Pk, set(seed), set(), index):
+                seed = shrink(Pk, seed, index)
+                #print('Shrank to:', seed, 'which works')
                 out.append(seed)
                 block = z3.Or([z3.Not(P[i]) for i, line_number in enumerate(conjecture_line_numbers) if line_number in seed])
-                #print 'Blocking:', block
+                #print('Blocking:', block)
                 solver.add(block)
             else:
-                seed = grow(Pk, seed)
-                #print 'Grew to:', seed, 'which does not work'
+                seed = grow(Pk, seed, index)
+                #print('Grew to:', seed, 'which does not work')
                 block = z3.Or([P[i] for i, line_number in enumerate(conjecture_line_numbers) if line_number not in seed])
-                #print 'Blocking:', block
+                #print('Blocking:', block)
                 solver.add(block)
         else:
-            #print out
+            #print(out)
             break
-    print 'Fully analyzed...', Pk
+    print('Fully analyzed...', Pk, '(skipped {} ivy_check calls by monotonicity)'.format(index.skipped))
     return out
 
-import multiprocessing
-p = multiprocessing.Pool(16)
-mu = p.map(marco, conjecture_line_numbers)
-
-entries = zip(conjecture_line_numbers, mu)
-
 def fancy_line_number(n):
     return '[' + str(n + 1) + '] ' + all_lines[n].replace('conjecture ', '')[:10] + '...';
 
 
-
-
-
-graph = ''
-
-graph += 'digraph G {' + '\n'
-graph += '  graph[label="%s"];' % (INPUT) + '\n'
-for source, targets in entries:
-    graph += '  %s[shape=box, label="%s"];' % (source, fancy_line_number(source)) + '\n'
-    if len(targets) > 0 and len(targets[0]) > 0:
-        graph += '  %s -> %s;' % (source, ', '.join(map(str, targets[0]))) + '\n'
-    if len(targets) > 1 and len(targets[1]) > 0:
-        graph += '  %s -> %s[style=dotted];' % (source, ', '.join(map(str, targets[1]))) + '\n'
-graph += '}' + '\n'
-
-
-
-
-repr_filename = BASE_NAME.replace('.ivy', '.out')
-print 'Writing graph repr to %s...' % (repr_filename)
-with open(repr_filename, 'w') as f:
-    f.write(repr(entries))
-
-graph_filename = BASE_NAME.replace('.ivy', '.dot')
-print 'Writing graph viz to %s...' % (graph_filename)
-with open(graph_filename, 'w') as f:
-    f.write(graph)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the induction graph of the conjectures in an Ivy file")
+    parser.add_argument('input_file', help='Ivy file with conjectures')
+    parser.add_argument('--ivy-check', dest='ivy_check', default='ivy_check',
+                        metavar='<IVY_CHECK>',
+                        help='ivy_check executable to query (e.g. a stub for testing)')
+    parser.add_argument('-j', dest='jobs', type=int, default=16,
+                        help='Number of worker processes')
+    args = parser.parse_args()
+
+    INPUT = args.input_file
+    BASE_NAME = os.path.basename(INPUT)
+    IVY_CHECK = args.ivy_check
+
+    print('Processing...', INPUT)
+
+    with open(INPUT) as f:
+        source = f.read().split('\n')
+    all_lines, conjecture_line_numbers = parse_conjectures(source)
+    print('The (zero-indexed) conjecture line numbers are:', conjecture_line_numbers)
+
+    manager = multiprocessing.Manager()
+    p = multiprocessing.Pool(args.jobs, initializer=init_worker, initargs=(manager.dict(),))
+    mu = p.map(marco, conjecture_line_numbers)
+
+    entries = list(zip(conjecture_line_numbers, mu))
+
+    graph = ''
+
+    graph += 'digraph G {' + '\n'
+    graph += '  graph[label="%s"];' % (INPUT) + '\n'
+    for source, targets in entries:
+        graph += '  %s[shape=box, label="%s"];' % (source, fancy_line_number(source)) + '\n'
+        if len(targets) > 0 and len(targets[0]) > 0:
+            graph += '  %s -> %s;' % (source, ', '.join(map(str, targets[0]))) + '\n'
+        if len(targets) > 1 and len(targets[1]) > 0:
+            graph += '  %s -> %s[style=dotted];' % (source, ', '.join(map(str, targets[1]))) + '\n'
+    graph += '}' + '\n'
+
+    repr_filename = BASE_NAME.replace('.ivy', '.out')
+    print('Writing graph repr to %s...' % (repr_filename))
+    with open(repr_filename, 'w') as f:
+        f.write(repr(entries))
+
+    graph_filename = BASE_NAME.replace('.ivy', '.dot')
+    print('Writing graph viz to %s...' % (graph_filename))
+    with open(graph_filename, 'w') as f:
+        f.write(graph)
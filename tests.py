@@ -1,6 +1,15 @@
 from graph import Graph
 
-from graph_utils import is_acyclic, print_graph, get_scc_graphs, bfs, dfs
+from pathlib import Path
+import pickle
+import random
+import subprocess
+import sys
+
+import cnf_utils
+from condensation import Condensation
+
+from graph_utils import is_acyclic, print_graph, get_scc_graphs, get_sccs, bfs, dfs
 
 
 def test_is_acyclic_tree():
@@ -94,3 +103,878 @@ def test_sccs():
             assert n not in visited_nodes, 'should only appear in one SCC'
             visited_nodes.add(n)
 
+
+def test_sparse_backend():
+    import pytest
+    pytest.importorskip('scipy')
+    import graph_utils_sparse
+    g = Graph(['0', '1', '2', '3', '4', '5'])
+    g.addEdge('0', '3')
+    g.addEdge('0', '2')
+    g.addEdge('2', '1')
+    g.addEdge('1', '0')
+    g.addEdge('3', '4')
+    g.addEdge('3', '4')
+
+    sccs = set(frozenset(scc) for scc in get_sccs(g))
+    assert set(frozenset(scc) for scc in graph_utils_sparse.get_sccs(g)) == sccs
+
+    assert graph_utils_sparse.bfs(g, '0') == bfs(g, '0')
+    assert graph_utils_sparse.bfs(g, '5')['0'] is None
+    assert len(graph_utils_sparse.get_wccs(g)) == 2
+
+def test_condensation():
+    g = Graph(['0', '1', '2', '3', '4'])
+    g.addEdge('0', '3')
+    g.addEdge('0', '2')
+    g.addEdge('2', '1')
+    g.addEdge('1', '0')
+    g.addEdge('1', '3')
+    g.addEdge('3', '4')
+
+    cond = Condensation(g, get_sccs(g))
+    assert sorted(cond.sizes) == [1, 1, 3]
+    assert cond.size_hist() == {1: 2, 3: 1}
+
+    big = cond.membership['0']
+    assert cond.membership['1'] == big and cond.membership['2'] == big
+    # the two edges into 3 are deduplicated
+    assert cond.dag_edges[big] == [cond.membership['3']]
+    assert cond.topo_order[0] == big
+    assert cond.depth[cond.membership['4']] == 2
+    assert cond.max_depth == 2
+    assert sorted(cond.scc_subgraph(g, big).nodes) == ['0', '1', '2']
+
+def test_stats_store(tmp_path):
+    import pytest
+    pytest.importorskip('numpy')
+    import corpus_stats
+    g = Graph(['Prop', '1', '2'])
+    g.addEdge('Prop', '1')
+    g.addEdge('1', '2')
+    g.addEdge('2', '1')
+
+    metrics = corpus_stats.graph_metrics(g, 'Prop', runtime=1.5)
+    assert metrics['scc_sizes'] == [1, 2]
+    assert metrics['bfs_layers'] == [1, 1, 1]
+    assert metrics['out_degree_hist'] == [0, 3]
+
+    path = tmp_path / 'stats.npz'
+    corpus_stats.append_metrics(path, 'a', metrics)
+    corpus_stats.append_metrics(path, 'b', corpus_stats.graph_metrics(Graph(['Prop']), 'Prop'))
+
+    store = corpus_stats.StatsStore(path)
+    assert list(store.column('num_edges')) == [3, 0]
+    assert store.rows['a']['bfs_layers'] == [1, 1, 1]
+    assert store.rows['b']['scc_sizes'] == [1]
+    assert store.rows['a']['runtime'] == 1.5
+
+def test_shared_cnf():
+    clauses = [[1, -2], [3], [-4, 5, 6]]
+    shared = cnf_utils.SharedCNF.from_clauses(clauses)
+    attached = cnf_utils.SharedCNF.attach(shared.handle())
+    assert list(attached.clauses()) == clauses
+    attached.close()
+    shared.close()
+
+def test_approx_cycle_rank():
+    from cycle_rank import approx_cycle_rank, compute_cycle_rank_caching
+    # two 3-cycles sharing node '0' plus a 2-cycle hanging off the first one
+    g = Graph(['0', '1', '2', '3', '4', '5', '6'])
+    g.addEdge('0', '1')
+    g.addEdge('1', '2')
+    g.addEdge('2', '0')
+    g.addEdge('0', '3')
+    g.addEdge('3', '4')
+    g.addEdge('4', '0')
+    g.addEdge('1', '5')
+    g.addEdge('5', '6')
+    g.addEdge('6', '5')
+
+    exact = compute_cycle_rank_caching(g)
+    lo, hi = approx_cycle_rank(g, timeout=1)
+    assert lo <= exact <= hi
+    assert lo == hi == 1
+
+def test_approx_cycle_rank_saves_cache(tmp_path):
+    # complete graph on 4 nodes, the lower bound only meets the upper one via sampled subgraphs
+    edges = [(a, b) for a in '0123' for b in '0123' if a != b]
+    with (tmp_path / 'g.pkl').open('wb') as f:
+        pickle.dump(edges, f)
+    cache_file = tmp_path / 'cache.pkl'
+    proc = subprocess.run([sys.executable, str(Path(__file__).parent / 'cycle_rank.py'), 'g.pkl',
+                           '--approx', '--timeout', '10', '--cache-file', str(cache_file)],
+                          cwd=tmp_path, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    assert 'Cycle rank is 3' in proc.stdout
+    with cache_file.open('rb') as f:
+        assert pickle.load(f)
+
+def test_canonical_key():
+    from cycle_rank import canonical_key, CycleRankCache
+    g1 = Graph(['a', 'b', 'c', 'd'])
+    g1.addEdge('a', 'b')
+    g1.addEdge('b', 'c')
+    g1.addEdge('c', 'a')
+    g1.addEdge('c', 'd')
+    # same structure, different names
+    g2 = Graph(['1', '2', '3', '4'])
+    g2.addEdge('4', '1')
+    g2.addEdge('1', '3')
+    g2.addEdge('3', '4')
+    g2.addEdge('3', '2')
+    assert canonical_key(g1) == canonical_key(g2)
+
+    g2.addEdge('2', '4')
+    assert canonical_key(g1) != canonical_key(g2)
+
+    # refinement can't tell the nodes of a cycle apart, the key still doesn't depend on the names
+    def cycle(names):
+        g = Graph(names)
+        for a, b in zip(names, names[1:] + names[:1]):
+            g.addEdge(a, b)
+        return g
+    assert canonical_key(cycle(['a', 'b', 'c', 'd'])) == canonical_key(cycle(['4', '2', '3', '1']))
+    assert canonical_key(cycle(['a', 'b', 'c', 'd'])) != canonical_key(cycle(['a', 'b', 'c']))
+    two_cycles = cycle(['a', 'b', 'c'])
+    two_cycles.nodes += ['x', 'y', 'z']
+    for a, b in [('x', 'y'), ('y', 'z'), ('z', 'x')]:
+        two_cycles.addEdge(a, b)
+    six_cycle = cycle(['a', 'b', 'c', 'x', 'y', 'z'])
+    assert canonical_key(two_cycles) != canonical_key(six_cycle)
+
+    # only the SCCs of the top level graph go into the cache
+    from cycle_rank import compute_cycle_rank_caching, cycle_rank_cache
+    cycle_rank_cache.entries.clear()
+    assert compute_cycle_rank_caching(g1) == 1
+    assert len(cycle_rank_cache.entries) == 1
+    assert compute_cycle_rank_caching(cycle(['p', 'q', 'r'])) == 1
+    assert len(cycle_rank_cache.entries) == 1
+
+    cache = CycleRankCache(maxsize=2)
+    cache['x'] = 1
+    cache['y'] = 2
+    cache['x']
+    cache['z'] = 3
+    assert 'x' in cache and 'z' in cache and 'y' not in cache
+
+def test_group_mus():
+    import pytest
+    z3 = pytest.importorskip('z3')
+    from gen_graph import GroupMUSSolver, get_mus_idx
+    x = [z3.Bool('x%i'%i) for i in range(4)]
+    # trans: x0' = x1 /\ x2, x1' = x3
+    x0p, x1p = z3.Bools('x0p x1p')
+    trans = z3.And(x0p == z3.And(x[1], x[2]), x1p == x[3])
+    invs = [x[0], x[1], x[2], x[3]]
+    targets = [z3.Not(x0p), z3.Not(x1p)]
+    gsolver = GroupMUSSolver(invs, hard=[trans])
+    muses = gsolver.group_mus(targets)
+    assert muses == [{1, 2}, {3}]
+    # warm start seeds that are (not) sufficient give the same MUSes
+    assert gsolver.group_mus(targets, [{0, 1, 2}, {0, 1, 2}]) == muses
+    # without x2 only the second target is implied
+    assert gsolver.group_mus(targets, support={0, 1, 3}) == [None, {3}]
+    for target, mus in zip(targets, muses):
+        single, approximate = get_mus_idx([trans] + invs + [target])
+        assert not approximate
+        assert set(i - 1 for i in single if 0 < i <= len(invs)) == mus
+
+def test_deletion_order():
+    import pytest
+    z3 = pytest.importorskip('z3')
+    from cnf_utils import Clause
+    from gen_graph import DeletionOrder
+    x = z3.Bools('y0 y1 y2')
+    invs = [Clause(x[0]), Clause(z3.Or(x[1], x[2])), Clause(x[2])]
+    clause_vars = {invs[0]: frozenset([0]), invs[1]: frozenset([1, 2]), invs[2]: frozenset([2])}
+    positions = {c: i for i, c in enumerate(invs)}
+
+    assert DeletionOrder('index', clause_vars, positions).key(invs[0]) is None
+    order = DeletionOrder('length', clause_vars, positions)
+    assert sorted(invs, key=order.key(invs[0])) == [invs[1], invs[0], invs[2]]
+    order = DeletionOrder('overlap', clause_vars, positions)
+    assert sorted(invs, key=order.key(invs[2])) == [invs[0], invs[1], invs[2]]
+    order = DeletionOrder('frequency', clause_vars, positions)
+    order.record({invs[0], invs[1]})
+    order.record({invs[0]})
+    assert sorted(invs, key=order.key(invs[0])) == [invs[2], invs[1], invs[0]]
+
+def test_read_dump_archive(tmp_path):
+    import io
+    import tarfile
+    files = {'d-trans.cnf': b'-5 3 0\n5 -3 0\n', 'd-inv.cnf': b'2 0\n3 0\n',
+             'd-inv-primed.cnf': b'5 0\n6 0\n', 'd-mapping.txt': b'2 5\n3 6\n'}
+    archive = tmp_path / 'dump.tar.gz'
+    with tarfile.open(str(archive), 'w:gz') as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    dump = cnf_utils.read_dump_archive(str(archive))
+    assert dump == {'trans': [[-5, 3], [5, -3]], 'inv': [[2], [3]],
+                    'inv-primed': [[5], [6]], 'mapping': [[2, 5], [3, 6]]}
+
+def test_stratified_estimate():
+    import random
+    from estimate_stats import stratified_mean, stratified_order, variance
+    strata = dict((c, c % 3) for c in range(30))
+    order = list(stratified_order(list(range(30)), strata, random.Random(0)))
+    assert sorted(order) == list(range(30))
+    # proportional allocation keeps every prefix balanced between the equally sized strata
+    assert sorted(strata[c] for c in order[:6]) == [0, 0, 1, 1, 2, 2]
+
+    mean, var = stratified_mean({0: [1.0, 3.0], 1: [10.0]}, {0: 2, 1: 2})
+    assert mean == 6.0
+    # the first stratum is fully sampled, the second one uses the variance of all samples
+    assert var == 0.25*variance([1.0, 3.0, 10.0])*0.5
+
+def test_reduction_and_dominators():
+    from condensation import reduce_graph
+    from graph_utils import dominators
+    # Prop -> a -> b -> c with shortcuts Prop -> c and a -> c, and a cycle b <-> d
+    g = Graph(['Prop', 'a', 'b', 'c', 'd'])
+    g.addEdge('Prop', 'a')
+    g.addEdge('Prop', 'c')
+    g.addEdge('a', 'b')
+    g.addEdge('a', 'c')
+    g.addEdge('b', 'c')
+    g.addEdge('b', 'd')
+    g.addEdge('d', 'b')
+    g.addEdge('d', 'c')
+
+    cond = Condensation(g, get_sccs(g))
+    reduced = reduce_graph(g, cond)
+    assert dict(reduced.edges) == {'Prop': ['a'], 'a': ['b'], 'b': ['c', 'd'], 'd': ['b', 'c']}
+
+    idom = dominators(g, 'Prop')
+    assert idom == {'Prop': None, 'a': 'Prop', 'b': 'a', 'c': 'Prop', 'd': 'b'}
+    assert dominators(g, 'b') == {'b': None, 'c': 'b', 'd': 'b'}
+
+def test_min_feedback_vertex_set():
+    import pytest
+    pytest.importorskip('z3')
+    from graph_utils import min_feedback_vertex_set, reduce_fvs
+    # a self loop on 0 and two 3-cycles sharing node 2, plus a 4-clique on 5-8
+    g = Graph([str(i) for i in range(9)])
+    g.addEdge('0', '0')
+    for src, sink in [('1', '2'), ('2', '3'), ('3', '1'), ('2', '4'), ('4', '1'), ('4', '0')]:
+        g.addEdge(src, sink)
+    for src in '5678':
+        for sink in '5678':
+            if src != sink:
+                g.addEdge(src, sink)
+
+    # the 3-cycles reduce to a self loop
+    succ = {'1': {'2'}, '2': {'3', '4'}, '3': {'1'}, '4': {'1'}}
+    pred = {'1': {'3', '4'}, '2': {'1'}, '3': {'2'}, '4': {'2'}}
+    fvs = set()
+    reduce_fvs(succ, pred, fvs)
+    assert not succ and len(fvs) == 1
+
+    # the self loop on 0 isn't counted as a cycle
+    fvs, lower = min_feedback_vertex_set(g)
+    assert lower == len(fvs) == 4
+    assert '0' not in fvs and len(fvs & {'5', '6', '7', '8'}) == 3
+    rest = [n for n in g.nodes if n not in fvs]
+    acyclic = Graph(rest)
+    for n in rest:
+        for m in g.edges[n]:
+            if m not in fvs and m != n:
+                acyclic.addEdge(n, m)
+    assert is_acyclic(acyclic)
+    # a graph whose only cycles are self loops is acyclic
+    loops = Graph(['a', 'b', 'c'])
+    for src, sink in [('a', 'a'), ('a', 'b'), ('b', 'b'), ('b', 'c'), ('c', 'c')]:
+        loops.addEdge(src, sink)
+    assert min_feedback_vertex_set(loops) == (set(), 0)
+
+def write_system(path, deps):
+    '''
+    Writes the trans, inv, inv-primed, init and mapping files of a system with x_i' = \\/_{d in deps[i]} x_d,
+    where the invariant is /\\ ~x_i. Clause i depends on the clauses deps[i] (other than itself) only.
+    '''
+    n = len(deps)
+    cur = lambda i: i + 2
+    nxt = lambda i: n + 2 + i
+    trans = []
+    for i in range(n):
+        trans.append([-nxt(i)] + [cur(d) for d in sorted(deps[i])])
+        trans += [[nxt(i), -cur(d)] for d in sorted(deps[i])]
+    cnfs = {'trans.cnf': trans, 'inv.cnf': [[-cur(i)] for i in range(n)],
+            'inv-primed.cnf': [[-nxt(i)] for i in range(n)], 'init.cnf': [[-cur(i)] for i in range(n)]}
+    for name, clauses in cnfs.items():
+        (path / name).write_text(''.join(' '.join(map(str, c)) + ' 0\n' for c in clauses))
+    (path / 'mapping.txt').write_text(''.join('{} {}\n'.format(cur(i), nxt(i)) for i in range(n)))
+
+def write_ring_system(path, n, seed=0):
+    '''
+    Writes a system (see write_system) with x_i' = x_{i+1} | x_b_i for random b_i, so the induction
+    graph is a cycle through all clauses plus the random edges. Returns the dependencies of each clause.
+    '''
+    rng = random.Random(seed)
+    deps = [{(i + 1) % n, rng.randrange(n)} for i in range(n)]
+    write_system(path, deps)
+    return deps
+
+def run_gen_graph(path, *flags, output=False):
+    '''
+    Runs gen_graph.py on the system written by write_system and returns the pickled edges
+    (and the printed output if output is set)
+    '''
+    gen_graph = str(Path(__file__).resolve().parent / 'gen_graph.py')
+    res = subprocess.run([sys.executable, gen_graph, '-t', 'trans.cnf', '-i', 'inv.cnf', '-ip', 'inv-primed.cnf',
+                          '-o', 'out', '--pickle'] + list(flags), cwd=str(path), check=True,
+                         stdout=subprocess.PIPE, universal_newlines=True)
+    with (path / 'out.pkl').open('rb') as f:
+        edges = pickle.load(f)
+    return (edges, res.stdout) if output else edges
+
+def test_min_deps(tmp_path):
+    from gen_graph import label2idx
+    deps = write_ring_system(tmp_path, 8)
+    edges = run_gen_graph(tmp_path)
+    assert set((label2idx(src), label2idx(dst)) for src, dst in edges) == \
+        set((i, d) for i in range(8) for d in deps[i] if d != i)
+    # the MUS of each clause is unique, so the minimum dependencies are the same
+    assert sorted(run_gen_graph(tmp_path, '--min-deps')) == sorted(edges)
+    assert sorted(run_gen_graph(tmp_path, '--min-deps', '--order', 'index')) == sorted(edges)
+
+def test_reduce_edges_through_prop(tmp_path):
+    from gen_graph import reduce_edges
+    # one SCC through the property, which is labeled differently as a source and as a sink
+    edges = [('0 (Prop)', '1'), ('1', '2'), ('2', '0 Prop'), ('0 (Prop)', '2'), ('2', '3')]
+    assert reduce_edges(edges) == edges
+    # implied by 2 -> 3 -> 4
+    assert reduce_edges(edges + [('3', '4'), ('2', '4')]) == edges + [('3', '4')]
+
+    write_ring_system(tmp_path, 10)
+    edges = run_gen_graph(tmp_path)
+    assert run_gen_graph(tmp_path, '--reduce') == edges
+
+def test_gen_graph_stats(tmp_path):
+    import corpus_stats
+    write_ring_system(tmp_path, 12)
+    edges = run_gen_graph(tmp_path, '--stats', 'stats.npz')
+    store = corpus_stats.StatsStore(tmp_path / 'stats.npz')
+    # the ring makes all 12 clauses one SCC, with the property counted once
+    assert store.rows['out']['num_nodes'] == 12
+    assert store.rows['out']['num_sccs'] == 1
+    assert store.rows['out']['scc_sizes'] == [12]
+    assert store.rows['out']['num_edges'] == len(set(edges))
+    assert sum(store.rows['out']['bfs_layers']) == 12
+
+def run_check_inv(path, *flags):
+    '''
+    Runs check_inv.py on the system written by write_ring_system and returns its exit code and output
+    '''
+    check_inv = str(Path(__file__).resolve().parent / 'check_inv.py')
+    res = subprocess.run([sys.executable, check_inv, '--trans', 'trans.cnf', '--inv', 'inv.cnf',
+                          '--primes', 'mapping.txt'] + list(flags),
+                         cwd=str(path), stdout=subprocess.PIPE, universal_newlines=True)
+    return res.returncode, res.stdout
+
+def test_check_inv_chunks_without_init(tmp_path):
+    write_ring_system(tmp_path, 6)
+    assert run_check_inv(tmp_path, '--chunks', '2', '-j', '2')[0] == 0
+
+def test_fast_and_chunked_check(tmp_path):
+    from cnf_utils import check_inductiveness_chunked, read_int_cnf
+    from check_inv import prime_int_clause, read_int_prime_mapping
+    n = 10
+    deps = write_ring_system(tmp_path, n)
+    inv = read_int_cnf(str(tmp_path / 'inv.cnf'))
+    dropped = 3
+    broken_inv = [c for i, c in enumerate(inv) if i != dropped]
+    # clauses that depend on the dropped one, indexed in broken_inv
+    not_inductive = [i - (i > dropped) for i in range(n) if i != dropped and dropped in deps[i]]
+    assert not_inductive
+    systems = [('init.cnf', inv, [], []),
+               ('init.cnf', broken_inv, [], not_inductive),
+               # x_1 holds initially, so clause 1 fails init -> inv
+               ('bad-init.cnf', inv, [1], [])]
+    (tmp_path / 'bad-init.cnf').write_text(''.join('{} 0\n'.format(i + 2 if i == 1 else -(i + 2))
+                                                   for i in range(n)))
+    for init, invl, failed_init, failed_cons in systems:
+        (tmp_path / 'inv.cnf').write_text(''.join(' '.join(map(str, c)) + ' 0\n' for c in invl))
+        # the default checker only reports OK/FAIL per check
+        _, out = run_check_inv(tmp_path, '--init', init)
+        assert 'init -> inv...{}'.format('FAIL' if failed_init else 'OK') in out
+        assert 'inv /\\ T |= inv...{}'.format('FAIL' if failed_cons else 'OK') in out
+        for jobs in ['1', '2']:
+            code, out = run_check_inv(tmp_path, '--init', init, '--fast', '-j', jobs)
+            assert code == (1 if failed_init or failed_cons else 0)
+            assert 'init -> inv...{}'.format('FAIL {}'.format(failed_init) if failed_init else 'OK') in out
+            assert 'inv /\\ T |= inv...{}'.format('FAIL {}'.format(failed_cons) if failed_cons else 'OK') in out
+        code, _ = run_check_inv(tmp_path, '--chunks', '3', '-j', '2')
+        assert code == (1 if failed_cons else 0)
+
+        mapping = read_int_prime_mapping(str(tmp_path / 'mapping.txt'))
+        base = [[-1]] + read_int_cnf(str(tmp_path / 'trans.cnf')) + invl
+        pinv = [prime_int_clause(c, mapping) for c in invl]
+        for num_chunks in [1, 4, len(invl)]:
+            failed = check_inductiveness_chunked(base, pinv, num_chunks, 2)
+            if failed_cons:
+                # the failing chunk holds at least one clause that isn't inductive
+                assert set(failed) & set(failed_cons)
+            else:
+                assert failed is None
+
+def test_portfolio_mus(monkeypatch):
+    import os
+    import pytest
+    z3 = pytest.importorskip('z3')
+    import gen_graph
+    x = [z3.Bool('p%i'%i) for i in range(4)]
+    x0p = z3.Bool('p0p')
+    # trans: x0' = x1 /\ x2
+    constraints = [x0p == z3.And(x[1], x[2])] + x + [z3.Not(x0p)]
+    single, approximate = gen_graph.get_mus_idx(constraints)
+    assert not approximate
+    assert gen_graph.portfolio_mus(constraints, 3) == (single, False)
+
+    # workers that die without answering are skipped, and fail the query if they all do
+    worker = gen_graph.portfolio_worker
+    def crashing_worker(constraints, config, timeout, queue):
+        if config[0] != 2:
+            os._exit(1)
+        worker(constraints, config, timeout, queue)
+    monkeypatch.setattr(gen_graph, 'portfolio_worker', crashing_worker)
+    monkeypatch.setattr(gen_graph, 'PORTFOLIO_POLL', 0.05)
+    assert gen_graph.portfolio_mus(constraints, 3) == (single, False)
+    with pytest.raises(RuntimeError):
+        gen_graph.portfolio_mus(constraints, 2)
+
+def test_frame_graphs(tmp_path):
+    n = 8
+    deps = write_ring_system(tmp_path, n)
+    inv = (tmp_path / 'inv.cnf').read_text().splitlines()
+    # nested frames, F_2 lacks clause 3 and F_3 also lacks clause 5
+    frames = [list(range(n)), [i for i in range(n) if i != 3], [i for i in range(n) if i not in (3, 5)]]
+    for k, frame in enumerate(frames):
+        (tmp_path / 'f{}.cnf'.format(k + 1)).write_text(''.join(inv[i] + '\n' for i in frame))
+    gen_graph = str(Path(__file__).resolve().parent / 'gen_graph.py')
+    subprocess.run([sys.executable, gen_graph, '-t', 'trans.cnf', '--frames', 'f1.cnf', 'f2.cnf', 'f3.cnf',
+                    '--primes', 'mapping.txt', '-o', 'out', '--pickle'],
+                   cwd=str(tmp_path), check=True, stdout=subprocess.DEVNULL)
+
+    for k, frame in enumerate(frames):
+        support = frames[max(k - 1, 0)]
+        with (tmp_path / 'out-frame{}.pkl'.format(k + 1)).open('rb') as f:
+            edges = pickle.load(f)
+        unsupported = sorted(i for i in frame if not deps[i] <= set(support))
+        assert set((int(src), int(dst)) for src, dst in edges) == \
+            set((i, d) for i in frame if i not in unsupported for d in deps[i] if d != i)
+        unsupported_file = tmp_path / 'out-frame{}.unsupported'.format(k + 1)
+        if unsupported:
+            assert sorted(int(i) for i in unsupported_file.read_text().split()) == unsupported
+        else:
+            assert not unsupported_file.exists()
+
+def test_min_deps_minimum():
+    import itertools
+    import pytest
+    z3 = pytest.importorskip('z3')
+    from cnf_utils import Clause
+    from gen_graph import get_min_deps
+    from marco import SubsetSolver
+    rng = random.Random(0)
+    x = [z3.Bool('m%i'%i) for i in range(5)]
+    xp = [z3.Bool('m%ip'%i) for i in range(5)]
+    lit = lambda v: v if rng.random() < 0.5 else z3.Not(v)
+    rand_clause = lambda vs: z3.Or([lit(v) for v in rng.sample(vs, rng.randint(1, 2))])
+
+    num_checked = 0
+    while num_checked < 10:
+        # each next state variable is the disjunction of two random current literals
+        trans = z3.And([xp[i] == z3.Or(lit(x[rng.randrange(5)]), lit(x[rng.randrange(5)])) for i in range(5)])
+        invs = [Clause(rand_clause(x)) for _ in range(7)]
+        npinv = z3.Not(rand_clause(xp))
+
+        def sufficient(subset):
+            s = z3.Solver()
+            s.add([trans, npinv] + [c._expr for c in subset])
+            return s.check() == z3.unsat
+        if not sufficient(invs):
+            continue
+        smallest = next(k for k in range(len(invs) + 1)
+                        if any(sufficient(c) for c in itertools.combinations(invs, k)))
+
+        csolver = SubsetSolver([c._expr for c in invs], hard=[trans])
+        cs_cache = []
+        deps, approximate = get_min_deps(csolver, invs, npinv, cs_cache)
+        assert not approximate and sufficient(deps) and len(deps) == smallest
+        # again, seeded with the correction sets of the first query
+        deps, _ = get_min_deps(csolver, invs, npinv, cs_cache)
+        assert sufficient(deps) and len(deps) == smallest
+        num_checked += 1
+
+def load_scrape(monkeypatch, tmp_path, deps):
+    import importlib.util
+    import json
+    spec = importlib.util.spec_from_file_location('scrape_from_ivy', 'scrape-from-ivy.py')
+    scrape = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(scrape)
+    # one conjecture per line, numbered like the stub expects
+    source = ['#lang ivy1.7'] + ['conjecture p{} = true'.format(i) for i in range(1, len(deps) + 1)]
+    scrape.all_lines, scrape.conjecture_line_numbers = scrape.parse_conjectures(source)
+    scrape.BASE_NAME = 'test.ivy'
+    scrape.IVY_CHECK = str(Path('ivy_check_stub.py').resolve())
+    (tmp_path / 'deps.json').write_text(json.dumps(deps))
+    monkeypatch.setenv('IVY_CHECK_STUB_DEPS', str(tmp_path / 'deps.json'))
+    calls = []
+    run_ivy_check = scrape.run_ivy_check
+    def counting_run(*query):
+        calls.append(query)
+        return run_ivy_check(*query)
+    monkeypatch.setattr(scrape, 'run_ivy_check', counting_run)
+    return scrape, calls
+
+def test_scrape_query_cache(monkeypatch, tmp_path):
+    import pytest
+    pytest.importorskip('z3')
+    scrape, calls = load_scrape(monkeypatch, tmp_path, {1: [[2]], 2: [[1, 3]], 3: [[]]})
+    assert scrape.conjecture_line_numbers == [1, 2, 3]
+    assert scrape.query(1, {2}, set()) and not scrape.query(2, {1}, set())
+    assert len(calls) == 2
+    # Pk itself is dropped from the conjectures, so this is the same query
+    assert scrape.query(1, {1, 2}, set()) and not scrape.query(2, {1}, set())
+    assert len(calls) == 2
+    # axioms are part of the key
+    assert scrape.query(2, {1}, {3})
+    assert len(calls) == 3
+
+def test_scrape_monotone_index(monkeypatch, tmp_path):
+    import pytest
+    pytest.importorskip('z3')
+    deps = {1: [[2, 3], [4]], 2: [[1]], 3: [[]], 4: [[2], [3]]}
+    scrape, calls = load_scrape(monkeypatch, tmp_path, deps)
+    index = scrape.MonotoneIndex()
+    index.add(index.to_bits({2, 3, 4}), True)
+    index.add(index.to_bits({2, 3}), True)
+    index.add(index.to_bits({2}), False)
+    index.add(index.to_bits({3}), False)
+    # only the minimal sufficient and maximal insufficient sets are kept
+    assert index.sufficient == [index.to_bits({2, 3})]
+    assert len(index.insufficient) == 2
+    assert index.lookup(index.to_bits({2, 3, 4})) is True
+    assert index.lookup(index.to_bits({3})) is False
+    assert index.lookup(index.to_bits({4})) is None
+    assert not calls
+
+    for Pk, expected in deps.items():
+        del calls[:]
+        mus = scrape.marco(Pk)
+        assert sorted(sorted(s) for s in mus) == sorted(sorted(s) for s in expected)
+        assert len(calls) == len(set(map(str, calls)))
+    # the skipped queries get the answers ivy_check would give
+    scrape.query_cache.clear()
+    index = scrape.MonotoneIndex()
+    seeds = [{2, 3}, {1, 2, 3}, {2}, set(), {4}, {3, 4}, {3}]
+    with_index = [scrape.query(1, s, set(), index) for s in seeds]
+    assert index.skipped == 3
+    assert with_index == [scrape.query(1, s, set()) for s in seeds]
+
+def test_reuse_deps(tmp_path):
+    import shutil
+    from cnf_utils import read_int_cnf
+    from gen_graph import label2idx
+    n = 10
+    old_deps = write_ring_system(tmp_path, n)
+    run_gen_graph(tmp_path)
+    shutil.copy(str(tmp_path / 'out.pkl'), str(tmp_path / 'prev.pkl'))
+    shutil.copy(str(tmp_path / 'inv.cnf'), str(tmp_path / 'prev-inv.cnf'))
+
+    def literal_edges(edges):
+        inv = read_int_cnf(str(tmp_path / 'inv.cnf'))
+        return sorted((sorted(inv[label2idx(src)]), sorted(inv[label2idx(dst)])) for src, dst in edges)
+
+    gen_graph = str(Path(__file__).resolve().parent / 'gen_graph.py')
+    def reuse_run():
+        out = subprocess.run([sys.executable, gen_graph, '-t', 'trans.cnf', '-i', 'inv.cnf', '-ip', 'inv-primed.cnf',
+                              '-o', 'out', '--pickle', '--prev-graph', 'prev.pkl', '--prev-inv', 'prev-inv.cnf'],
+                             cwd=str(tmp_path), check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        num_reused = int(out.split('Reused dependencies of ')[1].split('/')[0])
+        with (tmp_path / 'out.pkl').open('rb') as f:
+            return literal_edges(pickle.load(f)), num_reused
+
+    # same system with the clauses after the property in a different order
+    inv = read_int_cnf(str(tmp_path / 'inv.cnf'))
+    rest = inv[1:]
+    random.Random(1).shuffle(rest)
+    for name in ['inv.cnf', 'inv-primed.cnf']:
+        clauses = read_int_cnf(str(tmp_path / name))
+        order = [0] + [inv.index(c) for c in rest]
+        (tmp_path / name).write_text(''.join(' '.join(map(str, clauses[i])) + ' 0\n' for i in order))
+    fresh = literal_edges(run_gen_graph(tmp_path))
+    assert reuse_run() == (fresh, n)
+
+    # a different transition relation, where the old dependencies of some clauses don't hold anymore
+    (tmp_path / 'prev-inv.cnf').write_text((tmp_path / 'inv.cnf').read_text())
+    shutil.copy(str(tmp_path / 'out.pkl'), str(tmp_path / 'prev.pkl'))
+    new_deps = write_ring_system(tmp_path, n, seed=3)
+    # the old dependencies (and the clause itself) still suffice for some clauses, but aren't all needed
+    num_kept = sum(new_deps[i] - {i} <= old_deps[i] - {i} for i in range(n))
+    assert 0 < num_kept < n
+    assert any(new_deps[i] - {i} < old_deps[i] - {i} for i in range(n))
+    fresh = literal_edges(run_gen_graph(tmp_path))
+    assert reuse_run() == (fresh, num_kept)
+
+def test_explore_max_depth(tmp_path):
+    from gen_graph import LazyInductionGraph, label2idx
+    # a -> b -> c -> d plus a shortcut a -> c and a cycle back d -> a
+    succ = {'a': {'b', 'c'}, 'b': {'c'}, 'c': {'d'}, 'd': {'a'}}
+    dist = {'a': 0, 'b': 1, 'c': 1, 'd': 2}
+    for batch_size in [1, 2]:
+        for max_depth in [0, 1, 2, 3, None]:
+            computed = []
+            def compute_deps(n):
+                computed.append(n)
+                return set(succ[n])
+            def compute_group(group):
+                computed.extend(group)
+                return [set(succ[n]) for n in group]
+            g = LazyInductionGraph(compute_deps, compute_group, batch_size)
+            edges = set(g.explore(['a'], max_depth))
+            expanded = set(n for n in succ if max_depth is None or dist[n] < max_depth)
+            assert edges == set((n, d) for n in expanded for d in succ[n])
+            # clauses at the cutoff are never queried, even when prefetching
+            assert sorted(computed) == sorted(expanded)
+
+    deps = write_ring_system(tmp_path, 8)
+    for max_depth in [1, 2]:
+        edges = run_gen_graph(tmp_path, '--max-depth', str(max_depth))
+        layer, expanded = {0}, set()
+        for _ in range(max_depth):
+            expanded |= layer
+            layer = set(d for i in layer for d in deps[i] if d != i) - expanded
+        assert set((label2idx(src), label2idx(dst)) for src, dst in edges) == \
+            set((i, d) for i in expanded for d in deps[i] if d != i)
+
+def test_collapse_sample_json(tmp_path):
+    import json
+    import pytest
+    pytest.importorskip('graphviz')
+    from analyze_graphs import bfs_groups, collapse_graph, sample_graph, scc_groups, write_json
+    g = Graph(['Prop', '1', '2', '3', '4', '5'])
+    for src, sink in [('Prop', '1'), ('Prop', '2'), ('1', '2'), ('2', '1'), ('1', '3'), ('2', '3'),
+                      ('3', '4'), ('4', '3'), ('4', '5')]:
+        g.addEdge(src, sink)
+
+    groups = scc_groups(Condensation(g, get_sccs(g)))
+    summary, edge_counts = collapse_graph(g, groups)
+    a, b, c = groups['1'], groups['3'], groups['5']
+    assert groups['2'] == a and groups['4'] == b
+    assert sorted(summary.nodes) == sorted(set(groups.values()))
+    # edges within an SCC are dropped, parallel edges are counted
+    assert dict(edge_counts) == {(groups['Prop'], a): 2, (a, b): 2, (b, c): 1}
+    assert sorted((src, sink) for src, sinks in summary.edges.items() for sink in sinks) == sorted(edge_counts)
+    summary, edge_counts = collapse_graph(g, bfs_groups(g, 'Prop'))
+    assert dict(edge_counts) == {('layer0_1', 'layer1_2'): 2, ('layer1_2', 'layer2_1'): 2,
+                                 ('layer2_1', 'layer3_1'): 1, ('layer3_1', 'layer2_1'): 1,
+                                 ('layer3_1', 'layer4_1'): 1}
+
+    assert sample_graph(g, 6) is g
+    for seed in range(5):
+        sampled = sample_graph(g, 3, keep=['Prop', 'missing'], seed=seed)
+        assert len(sampled.nodes) == 3 and 'Prop' in sampled.nodes
+        # the induced subgraph: every edge between sampled nodes and nothing else
+        assert sorted((src, sink) for src, sinks in sampled.edges.items() for sink in sinks) == \
+            sorted((src, sink) for src, sinks in g.edges.items() for sink in sinks
+                   if src in sampled.nodes and sink in sampled.nodes)
+    assert sorted(sample_graph(g, 3, seed=1).nodes) == sorted(sample_graph(g, 3, seed=1).nodes)
+
+    write_json(summary, tmp_path / 'g.json', edge_counts)
+    data = json.loads((tmp_path / 'g.json').read_text())
+    assert sorted(n['id'] for n in data['nodes']) == sorted(summary.nodes)
+    assert sorted((l['source'], l['target'], l['count']) for l in data['links']) == \
+        sorted((src, sink, count) for (src, sink), count in edge_counts.items())
+    # without counts every edge counts once
+    write_json(g, tmp_path / 'g.json')
+    data = json.loads((tmp_path / 'g.json').read_text())
+    assert len(data['links']) == 9 and all(l['count'] == 1 for l in data['links'])
+
+def test_cnf_inputs(tmp_path):
+    import gzip
+    import os
+    import threading
+    from cnf_utils import iter_cnf_lines, read_cnf, read_int_cnf
+    text = 'c a comment\np cnf 6 4\n1 -2 0\n\n-3 4 5 0\n6 0\n  -1 -6 0'
+    expected = [[1, -2], [-3, 4, 5], [6], [-1, -6]]
+    (tmp_path / 'plain.cnf').write_text(text)
+    with gzip.open(str(tmp_path / 'plain.cnf.gz'), 'wt') as f:
+        f.write(text)
+    # regular files are memory mapped, the reference reads them line by line
+    with open(str(tmp_path / 'plain.cnf'), 'rb') as f:
+        lines = f.readlines()
+    assert list(iter_cnf_lines(str(tmp_path / 'plain.cnf'))) == lines
+    assert list(iter_cnf_lines(str(tmp_path / 'plain.cnf.gz'))) == lines
+    for name in ['plain.cnf', 'plain.cnf.gz']:
+        assert read_int_cnf(str(tmp_path / name)) == expected
+        assert [str(c._expr) for c in read_cnf(str(tmp_path / name))] == \
+            [str(c._expr) for c in read_cnf(str(tmp_path / 'plain.cnf'))]
+
+    # named pipes are read as they are written
+    pipe = str(tmp_path / 'pipe.cnf')
+    os.mkfifo(pipe)
+    def write():
+        with open(pipe, 'w') as f:
+            f.write(text)
+    writer = threading.Thread(target=write)
+    writer.start()
+    assert read_int_cnf(pipe) == expected
+    writer.join()
+
+    # empty files can't be mapped
+    (tmp_path / 'empty.cnf').write_text('')
+    with gzip.open(str(tmp_path / 'empty.cnf.gz'), 'wt') as f:
+        pass
+    assert read_int_cnf(str(tmp_path / 'empty.cnf')) == read_int_cnf(str(tmp_path / 'empty.cnf.gz')) == []
+
+def test_mus_timeout(monkeypatch):
+    import pytest
+    z3 = pytest.importorskip('z3')
+    import gen_graph
+    x, y, z = z3.Bools('tx ty tz')
+    constraints = [x, y, z3.Not(x), z, x, z3.Or(z3.Not(y), z3.Not(z)), y, z3.Not(x)]
+    def unsat(idxs):
+        s = z3.Solver()
+        s.add([constraints[i] for i in idxs])
+        return s.check() == z3.unsat
+
+    class FakeClock:
+        # every query takes a second
+        now = 0
+        @classmethod
+        def time(cls):
+            cls.now += 1
+            return cls.now
+    monkeypatch.setattr(gen_graph, 'time', FakeClock)
+    num_approximate = 0
+    for timeout in range(1, 12):
+        for order in [None, list(reversed(range(len(constraints))))]:
+            mus, approximate = gen_graph.get_mus_idx(constraints, timeout, order)
+            # even when shrinking stops early the result is an unsat subset
+            assert unsat(mus)
+            if timeout == 1:
+                # out of time before the first query
+                assert approximate and mus == set(range(len(constraints)))
+            if approximate:
+                num_approximate += 1
+            else:
+                assert all(not unsat(mus - {i}) for i in mus)
+    assert 2 < num_approximate < 20
+
+def failing_consecution_chunk(idxs):
+    raise RuntimeError('worker failed')
+
+def test_fast_check_releases_shared_trans(tmp_path, monkeypatch):
+    from multiprocessing import shared_memory
+    import pytest
+    import check_inv
+    from cnf_utils import SharedCNF, read_int_cnf
+    write_ring_system(tmp_path, 6)
+    trans, inv, init = [read_int_cnf(str(tmp_path / name)) for name in ['trans.cnf', 'inv.cnf', 'init.cnf']]
+    mapping = check_inv.read_int_prime_mapping(str(tmp_path / 'mapping.txt'))
+    names = []
+    from_clauses = SharedCNF.from_clauses
+    def recording_from_clauses(clauses):
+        shared = from_clauses(clauses)
+        names.append(shared.handle()[0])
+        return shared
+    monkeypatch.setattr(SharedCNF, 'from_clauses', staticmethod(recording_from_clauses))
+    monkeypatch.setattr(check_inv, 'check_consecution_chunk', failing_consecution_chunk)
+    with pytest.raises(RuntimeError):
+        check_inv.fast_check(init, trans, inv, mapping, jobs=2)
+    assert len(names) == 1
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(names[0])
+
+def test_estimate_stats_stops_within_sample():
+    import os
+    import signal
+    from estimate_stats import estimate_stats
+    from gen_graph import LazyInductionGraph
+    # two disjoint rings of n clauses
+    n = 200
+    queries = []
+    def compute_deps(c):
+        queries.append(c)
+        # Ctrl-C in the middle of the cycle search of the second sample
+        if len(queries) == n + 20:
+            os.kill(os.getpid(), signal.SIGINT)
+        return {c - c % n + (c + 1) % n}
+    handler = signal.getsignal(signal.SIGINT)
+    invs = list(range(2*n))
+    stats = estimate_stats(LazyInductionGraph(compute_deps), invs, iter([5, n + 5, 7]),
+                           dict((c, 0) for c in invs))
+    # the first sample queried its whole ring, the unfinished second one is dropped
+    assert stats['samples'] == 1 and stats['out_degree'][0] == 1.0 and stats['in_cycles'][0] == 1.0
+    assert len(queries) == n + 20
+    assert signal.getsignal(signal.SIGINT) is handler
+
+def test_warm_start(tmp_path):
+    # the property depends on one clause of each module a -> {b, c}, b -> {c, d}, c -> {b, d}, d -> {b, c},
+    # so the dependencies of c are those of its sibling b and d has the same ones as its siblings
+    num_modules = 10
+    deps = [set(1 + 4*m for m in range(num_modules))]
+    for m in range(num_modules):
+        a, b, c, d = range(1 + 4*m, 5 + 4*m)
+        deps += [{b, c}, {c, d}, {b, d}, {b, c}]
+    write_system(tmp_path, deps)
+    calls = lambda out: int(out.split('Made ')[1].split(' solver calls')[0])
+    edges, out = run_gen_graph(tmp_path, output=True)
+    for flags in [['--batch-size', '4'], []]:
+        warm_edges, warm_out = run_gen_graph(tmp_path, '--warm-start', *flags, output=True)
+        assert sorted(warm_edges) == sorted(edges)
+        hits, queries = map(int, warm_out.split('Warm start seed sufficed for ')[1].split(' ')[0].split('/'))
+        assert queries == len(deps) - 1 and hits >= num_modules
+    # c and d hit in every module, shrinking from the small seeds saves queries
+    assert hits == 2*num_modules and calls(warm_out) < calls(out)
+
+def test_analyze_gen_graph_labels(tmp_path):
+    from gen_graph import reduce_edges
+    # as labeled by gen_graph, the property is '0 (Prop)' as a source and '0 Prop' as a sink
+    edges = [('0 (Prop)', '1'), ('1', '2'), ('2', '0 Prop'), ('0 (Prop)', '2'), ('2', '3'), ('3', '4'), ('2', '4')]
+    with (tmp_path / 'g.pkl').open('wb') as f:
+        pickle.dump(edges, f)
+    analyze_graphs = str(Path(__file__).resolve().parent / 'analyze_graphs.py')
+    def analyze(*flags):
+        return subprocess.run([sys.executable, analyze_graphs, 'g.pkl'] + list(flags), cwd=str(tmp_path),
+                              check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+
+    # only 2 -> 4 is implied by 2 -> 3 -> 4, the edges within the SCC of the property are kept
+    analyze('--proc', 'reduce')
+    with (tmp_path / 'g-reduced.pkl').open('rb') as f:
+        reduced = pickle.load(f)
+    assert reduced == reduce_edges(edges) == edges[:-1]
+    assert 'Found 3 SCCs' in analyze('--proc', 'num')
+    # every path from the property to 3 and 4 goes through 2
+    assert '2: 2 (immediate dominator Prop)' in analyze('--proc', 'dominators')
+
+def test_sparse_backend_output(tmp_path):
+    import pytest
+    pytest.importorskip('scipy')
+    pytest.importorskip('graphviz')
+    import graph_utils_sparse
+    from analyze_graphs import gen_dot, gen_scc_graph
+    rng = random.Random(0)
+    edges = [(str(rng.randrange(60)), str(rng.randrange(60))) for _ in range(90)]
+    with (tmp_path / 'g.pkl').open('wb') as f:
+        pickle.dump(edges, f)
+    g = Graph(list(set(n for e in edges for n in e)))
+    for n1, n2 in edges:
+        g.addEdge(n1, n2)
+    # the SCC names of scc-dot
+    assert gen_dot(gen_scc_graph(Condensation(g, graph_utils_sparse.get_sccs(g)))).source == \
+        gen_dot(gen_scc_graph(Condensation(g, get_sccs(g)))).source
+
+    analyze_graphs = str(Path(__file__).resolve().parent / 'analyze_graphs.py')
+    def scc_list(*flags):
+        return subprocess.run([sys.executable, analyze_graphs, 'g.pkl', '--proc', 'list'] + list(flags),
+                              cwd=str(tmp_path), check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    out = scc_list('--no-cache')
+    assert len(out.split('\n')) > 10
+    # different hash seeds give the python backend a different node order
+    for backend in ['python', 'sparse', 'python']:
+        assert scc_list('--backend', backend) == scc_list('--backend', backend, '--no-cache') == out